@@ -1,13 +1,17 @@
 from fastapi import Depends, HTTPException, status, Header, Request
-from typing import Optional
+import hashlib
+import time
+from typing import Any, Dict, Optional
 from jose import JWTError, ExpiredSignatureError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 
 from app.core.config import settings
-from app.database import get_db
-from app import crud, models, schemas
-from app.models.user import User
+from app.core import identity, metrics
+from app.core.cache import CACHE_COUNTERS, LRUCache
+from app.core.identity import UserIdentity
+from app.database import get_async_db
+from app import crud
 
 # --- FIX: Initialize the logger for this module ---
 logger = logging.getLogger(__name__)
@@ -15,12 +19,34 @@ logger = logging.getLogger(__name__)
 # --- KEY CHANGE: Use the correct algorithm used by NextAuth.js by default ---
 ALGORITHM = "HS256"
 
+# Verified JWT claims, keyed by the token's SHA-256 digest (raw tokens are never kept).
+# An entry never outlives the token's `exp`, so expired tokens always fail verification.
+claims_cache: LRUCache[bytes, Dict[str, Any]] = LRUCache(
+    max_entries=settings.JWT_CLAIMS_CACHE_MAX_ENTRIES,
+    ttl=settings.JWT_CLAIMS_CACHE_TTL,
+)
+
+metrics.stats_collector("jwt_claims_cache", "Verified JWT claims cache size (entries).", claims_cache.stats, counters=CACHE_COUNTERS)
+
+def decode_token(token: str) -> Dict[str, Any]:
+    """Verifies a NextAuth JWT and returns its claims, skipping verification for recently verified tokens."""
+    digest = hashlib.sha256(token.encode()).digest()
+    claims = claims_cache.get(digest)
+    if claims is not None:
+        return claims
+    claims = jwt.decode(token, settings.NEXTAUTH_SECRET, algorithms=[ALGORITHM])
+    ttl = settings.JWT_CLAIMS_CACHE_TTL
+    if "exp" in claims:
+        ttl = min(ttl, claims["exp"] - time.time())
+    if ttl > 0:
+        claims_cache.set(digest, claims, ttl=ttl)
+    return claims
+
 # The get_current_user function remains for endpoints that strictly require a user.
-# (No changes needed here for now)
-def get_current_user(
-    db: Session = Depends(get_db),
+async def get_current_user(
+    db: AsyncSession = Depends(get_async_db),
     authorization: Optional[str] = Header(None)
-) -> User:
+) -> UserIdentity:
     if authorization is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -36,7 +62,7 @@ def get_current_user(
 
     try:
         # --- CORRECTING THE KEY: Use NEXTAUTH_SECRET which is correctly defined in config.py ---
-        payload = jwt.decode(token, settings.NEXTAUTH_SECRET, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(
@@ -56,52 +82,54 @@ def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = crud.get_user(db, user_id=int(user_id))
+    # NextAuth user ids are strings (CUIDs), the same ids sent in X-User-Id.
+    user_id = str(user_id)
+    cached = identity.get_identity(user_id)
+    if cached:
+        return cached
+
+    user = await crud.async_user.get_by_id_str(db, id=user_id)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
     
-    return user
+    return identity.remember(user_id, user)
 
 # --- KEY CHANGE: Prioritize reading user ID from header as per your guide ---
 async def get_current_user_optional(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     x_user_id: Optional[str] = Header(None, alias="X-User-Id"),
     x_user_email: Optional[str] = Header(None, alias="X-User-Email"),
-) -> Optional[models.User]:
+) -> Optional[UserIdentity]:
     """
     Dependency to get the current user from header information.
     This is an optional dependency; it returns the user if found, or None otherwise.
     It does not raise an exception if the user is not found or headers are missing.
+    Resolved identities are cached per process, so repeat requests skip the database.
     """
-    logging.info("[dependencies.py] Entering get_current_user_optional")
     if not x_user_id:
-        logging.info("[dependencies.py] No X-User-Id header found.")
+        logger.debug("No X-User-Id header found.")
         return None
 
-    logging.info(f"[dependencies.py] Found user ID '{x_user_id}' in X-User-Id header.")
+    cached = identity.get_identity(x_user_id)
+    if cached:
+        return cached
 
     # The user ID from NextAuth is a string (CUID).
     # We query by the string ID directly.
-    user = crud.user.get_by_id_str(db, id=x_user_id)
+    user = await crud.async_user.get_by_id_str(db, id=x_user_id)
     if user:
-        logging.info(f"[dependencies.py] Successfully found user by string ID: {user.email}")
-        return user
+        logger.debug("Found user by X-User-Id", extra={"user_id": x_user_id})
+        return identity.remember(x_user_id, user)
 
     # If user is not found by ID, try to find or create them by email.
     # This is a fallback and helps sync users who might not exist in our DB yet.
     if x_user_email:
-        logging.info(f"[dependencies.py] User not found by ID, trying to find or create by email: {x_user_email}")
-        user = crud.user.get_by_email(db, email=x_user_email)
-        if not user:
-            logging.info(f"[dependencies.py] User not found by email, creating a new one.")
-            # Use the ID from the header for the new user.
-            user_in = schemas.UserCreate(id=x_user_id, email=x_user_email, password="password_placeholder")
-            user = crud.user.create_with_id(db, obj_in=user_in)
-            logging.info(f"[dependencies.py] Created new user: {user.email} with ID {user.id}")
-        else:
-            logging.info(f"[dependencies.py] Found existing user by email: {user.email}")
-        return user
+        logger.info("User not found by ID, finding or creating by email", extra={"user_id": x_user_id})
+        # Use the ID from the header for a new user. No password is hashed:
+        # these users only ever sign in through NextAuth.
+        user = await crud.async_user.upsert_external(db, id=x_user_id, email=x_user_email)
+        return identity.remember(x_user_id, user) if user else None
         
-    logging.warning(f"[dependencies.py] Could not authenticate user with ID '{x_user_id}'. Returning None.")
-    return None 
\ No newline at end of file
+    logger.warning("Could not authenticate user from headers", extra={"user_id": x_user_id})
+    return None
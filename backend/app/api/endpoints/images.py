@@ -1,59 +1,158 @@
 import logging
-import json
-from fastapi import APIRouter, Body, Depends, HTTPException, Response, File, UploadFile, Request
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Response, File, UploadFile, Request, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.formparsers import MultiPartException, MultiPartParser
+from sqlalchemy.ext.asyncio import AsyncSession
 import base64
-import io
-from PIL import Image
-from io import BytesIO
 import time
 import httpx
-from typing import Optional, List
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Set, Tuple, TypeVar, Union
 import asyncio
 import uuid
 import random
+import hashlib
+import math
+from dataclasses import dataclass, field
 
 from app.core.config import settings
+from app.core import http_client, imaging, metrics
+from app.core.cache import CACHE_COUNTERS, LRUCache
+from app.core.singleflight import SINGLE_FLIGHT_COUNTERS, SingleFlight
+from app.core.ratelimit import ClientQuota, UpstreamBusy, get_limiter
+from app.core.responses import ORJSONResponse, RawJSON, dumps
+from app.core.resilience import RetryBudget, call_with_resilience, get_latency_tracker
+from app.core.jobs import Job, JobQueueFull, JobStatus, job_queue
+from app.core.storage import blob_store, content_hash, is_valid_key, sniff_content_type
 from app.api import dependencies as deps
-from app.database import get_db
-from app.models.user import User
+from app.database import AsyncSessionLocal, get_async_db, get_async_read_db
+from app.core.identity import UserIdentity
 import app.schemas as schemas
 import app.crud as crud
+from app.crud.credit import new_reference
 
 router = APIRouter()
 
+T = TypeVar("T")
+
 # Setup logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# --- Fireworks.ai API Configuration ---
-FIREWORKS_API_BASE_URL = "https://api.fireworks.ai/inference/v1/workflows/accounts/"
+# --- Fireworks.ai API Configuration (base URL: FIREWORKS_API_BASE_URL in Config) ---
+@dataclass(frozen=True)
+class ModelSpec:
+    path: str
+    # Max images a single upstream call may return via "samples".
+    # 1 means the model only returns one image per call, so requests fan out.
+    max_samples: int = 1
+
 MODEL_MAP = {
     # This is the "Schnell" model, using the dev-fp8 path.
-    "tt-flux1-schnell": "fireworks/models/flux-1-dev-fp8",
+    "tt-flux1-schnell": ModelSpec("fireworks/models/flux-1-dev-fp8"),
 
     # "Original" also points to the same fast model as per request.
-    "flux1-dev": "fireworks/models/flux-1-dev-fp8", 
+    "flux1-dev": ModelSpec("fireworks/models/flux-1-dev-fp8"), 
     
     # Community hosted models require the specific account path
     # --- KEY CHANGE: Updated the Pro model to point to the requested dev model ---
-    "tt-flux1-pro": "fireworks/models/flux-1-dev-fp8",
-    "seedream3": "fal-ai/models/seedream-3.0",
+    "tt-flux1-pro": ModelSpec("fireworks/models/flux-1-dev-fp8"),
+    "seedream3": ModelSpec("fal-ai/models/seedream-3.0"),
 }
 
+STANDARD_COST_PER_IMAGE = 1
+PRO_COST_PER_IMAGE = 5
+
+# --- Metrics (exposed at /metrics) ---
+GENERATION_STAGE_SECONDS = metrics.Histogram(
+    "generation_stage_seconds",
+    "Time spent in each stage of a generation request.",
+    ["stage"],
+)
+UPSTREAM_REQUESTS = metrics.Counter(
+    "upstream_requests_total",
+    "Individual upstream generation calls (including retries and hedges), by model and HTTP status.",
+    ["model", "status"],
+)
+UPSTREAM_REQUEST_SECONDS = metrics.Histogram(
+    "upstream_request_seconds",
+    "Latency of individual upstream generation calls, by model.",
+    ["model"],
+)
+TURNSTILE_VERIFICATIONS = metrics.Counter(
+    "turnstile_verifications_total",
+    "Cloudflare Turnstile verifications, by result.",
+    ["result"],
+)
+
+# Digests of recently verified tokens. Cloudflare accepts a token only once, so
+# without this a client retrying a failed request would also need a new challenge.
+# Verification overlaps with the credit reservation, so the token has usually been
+# sent to Cloudflare before a 402 is known; the shared flight below finishes and
+# records it even when that request gives up, and the retry is accepted from here.
+turnstile_cache: LRUCache[bytes, bool] = LRUCache(
+    max_entries=settings.TURNSTILE_VERIFIED_CACHE_MAX_ENTRIES,
+    ttl=settings.TURNSTILE_VERIFIED_CACHE_TTL,
+)
+turnstile_flights = SingleFlight()
+
+metrics.stats_collector("turnstile_cache", "Verified Turnstile token cache size (entries).", turnstile_cache.stats, counters=CACHE_COUNTERS)
+
+async def siteverify(token: str) -> None:
+    client = http_client.turnstile_client()
+    with GENERATION_STAGE_SECONDS.time(stage="turnstile"):
+        try:
+            response = await client.post(
+                settings.TURNSTILE_VERIFY_URL,
+                data={"secret": settings.CLOUDFLARE_TURNSTILE_SECRET_KEY, "response": token},
+            )
+            data = response.json()
+        except Exception:
+            TURNSTILE_VERIFICATIONS.inc(result="error")
+            raise
+    if not data.get("success"):
+        TURNSTILE_VERIFICATIONS.inc(result="failed")
+        logger.error(f"Cloudflare Turnstile verification failed: {data.get('error-codes')}")
+        raise HTTPException(status_code=403, detail="Cloudflare Turnstile verification failed.")
+    TURNSTILE_VERIFICATIONS.inc(result="success")
+
 async def verify_turnstile(token: str):
     if not token:
         raise HTTPException(status_code=400, detail="Turnstile token is missing.")
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://challenges.cloudflare.com/turnstile/v0/siteverify",
-            data={"secret": settings.CLOUDFLARE_TURNSTILE_SECRET_KEY, "response": token},
-        )
-        data = response.json()
-        if not data.get("success"):
-            logger.error(f"Cloudflare Turnstile verification failed: {data.get('error-codes')}")
-            raise HTTPException(status_code=403, detail="Cloudflare Turnstile verification failed.")
+    if settings.TURNSTILE_VERIFIED_CACHE_TTL <= 0:
+        return await siteverify(token)
+
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    if turnstile_cache.get(digest):
+        TURNSTILE_VERIFICATIONS.inc(result="cached")
+        return
+
+    async def verify_and_remember() -> None:
+        await siteverify(token)
+        turnstile_cache.set(digest, True)
+
+    # Concurrent requests with the same token (e.g. a double submit) share one verification.
+    await turnstile_flights.do(digest, verify_and_remember)
+
+async def start_turnstile_verification(request: Request) -> AsyncIterator[asyncio.Task]:
+    """
+    Dependency that starts verifying the request's Turnstile token as soon as the
+    body has been read. Declared before the user dependency, the Cloudflare round
+    trip then overlaps with resolving the user and reserving credits; the handler
+    awaits the task before anything is charged or sent upstream. If the request
+    fails before that, the verification is cancelled.
+    """
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    token = body.get("turnstile_token") if isinstance(body, dict) else None
+    task = asyncio.create_task(verify_turnstile(token if isinstance(token, str) else ""))
+    try:
+        yield task
+    finally:
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()  # Mark as retrieved if the request failed before awaiting it
 
 def construct_prompt(data: schemas.ImageCreate) -> str:
     """Constructs a detailed prompt from various style attributes."""
@@ -77,7 +176,7 @@ async def healthcheck():
     """
     A simple endpoint to confirm that the API is running.
     """
-    logger.info("Healthcheck endpoint was hit!")
+    logger.debug("Healthcheck endpoint was hit!")
     return {"status": "ok"}
 
 def parse_aspect_ratio(ratio_str: Optional[str]) -> (int, int):
@@ -101,156 +200,1086 @@ def parse_aspect_ratio(ratio_str: Optional[str]) -> (int, int):
     
     return resolutions.get(ratio_str, (1024, 1024))
 
-@router.post("/generate/", response_class=JSONResponse, summary="Generate Image with Fireworks.ai FLUX.1")
-async def generate_image(
-    request: Request, # Add Request to the function signature
-    image_in: schemas.ImageCreate, 
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(deps.get_current_user_optional) # <-- CORRECT way to use dependency
-):
+def get_generation_cost(current_user: Optional[UserIdentity], model_id: str, num_images: int) -> int:
     """
-    Generate an image based on the provided prompt using Fireworks.ai FLUX.1 API.
-    Images are returned as Base64 data URLs and are not stored on the server.
+    Works out how many credits a generation costs for this user, model and image count.
+    Raises 403 if the user is not allowed to generate with the model. Whether the
+    user can afford it is decided when the credits are reserved.
     """
-    print(f"\n[BACKEND] images.py: --- [/generate] Endpoint hit ---")
-    print(f"[BACKEND] images.py: Received request body: {image_in.model_dump_json(indent=2)}")
-
-    if not settings.FIREWORKS_API_KEY or settings.FIREWORKS_API_KEY == "your_fireworks_api_key_here":
-        print("[BACKEND] images.py: CRITICAL: Fireworks API key is not configured on the server.")
-        print("[BACKEND] images.py: Please set FIREWORKS_API_KEY in your .env file with a valid API key from Fireworks.ai")
-        raise HTTPException(status_code=500, detail="Fireworks API key is not configured. Please contact administrator.")
-
-    model_id = image_in.model or "tt-flux1-schnell"
-    generation_cost = 4  # Default cost for 4 images
+    generation_cost = STANDARD_COST_PER_IMAGE * num_images  # Default cost, 4 credits for 4 images
 
     # --- Credit and Subscription Logic ---
     if current_user:
-        print(f"[BACKEND] images.py: Authenticated user: {current_user.email} (ID: {current_user.id}). Credits: {current_user.credits}")
+        logger.debug("Authenticated user", extra={"user_id": current_user.id})
         
         is_pro_model = model_id == "tt-flux1-pro"
         has_pro_subscription = current_user.creem_price_id == 'price_ultimate'
 
         # Pro model logic: requires subscription OR sufficient credits
         if is_pro_model and not has_pro_subscription:
-            print("[BACKEND] images.py: User wants Pro model but lacks subscription. Checking credits as fallback.")
-            generation_cost = 20 # Pro model costs more credits
-            if current_user.credits < generation_cost:
-                print(f"[BACKEND] images.py: WARNING: User {current_user.id} has insufficient credits for Pro model.")
-                raise HTTPException(
-                    status_code=402, # 402 Payment Required
-                    detail=f"Using the Pro model without a subscription costs {generation_cost} credits, but you only have {current_user.credits}."
-                )
-        # Standard model logic: just check credits
-        elif not is_pro_model:
-            if current_user.credits < generation_cost:
-                print(f"[BACKEND] images.py: WARNING: User {current_user.id} has insufficient credits for standard model.")
-                raise HTTPException(
-                    status_code=402,
-                    detail=f"Insufficient credits. You need {generation_cost} credits for 4 images, but you only have {current_user.credits}."
-                )
+            logger.debug("User wants Pro model but lacks subscription. Charging credits as fallback.")
+            generation_cost = PRO_COST_PER_IMAGE * num_images # Pro model costs more credits
         # If user has Pro subscription, generation is free (cost is 0)
-        else: # is_pro_model and has_pro_subscription
+        elif is_pro_model: # is_pro_model and has_pro_subscription
              generation_cost = 0
-             print("[BACKEND] images.py: User has Pro subscription. Generation is free.")
+             logger.debug("User has Pro subscription. Generation is free.")
 
     elif model_id == "tt-flux1-pro":
         # Anonymous users cannot use the Pro model at all
-        print("[BACKEND] images.py: WARNING: Anonymous user attempted to use Pro model.")
+        logger.info("Anonymous user attempted to use Pro model.")
         raise HTTPException(status_code=403, detail="You must be logged in and have a Pro subscription or sufficient credits to use this model.")
-    
-    model_path = MODEL_MAP.get(model_id)
-    if not model_path:
-        print(f"[BACKEND] images.py: ERROR: Unsupported model selected: {model_id}")
+
+    return generation_cost
+
+def log_generation_request(image_in: schemas.ImageCreate) -> None:
+    """Logs a summary of a generation request; large and sensitive fields are left out or truncated."""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Generation request",
+            extra={"request_body": image_in.model_dump(exclude={"image_b64", "turnstile_token"})},
+        )
+
+def get_model_spec(model_id: str) -> ModelSpec:
+    """Resolves a frontend model id to its upstream model."""
+    model_spec = MODEL_MAP.get(model_id)
+    if not model_spec:
+        logger.info("Unsupported model selected", extra={"model": model_id})
         raise HTTPException(status_code=400, detail=f"Unsupported model selected: {model_id}")
-    
-    fireworks_api_url = f"{FIREWORKS_API_BASE_URL}{model_path}/text_to_image"
-    print(f"[BACKEND] images.py: Targeting Fireworks.ai endpoint: {fireworks_api_url}")
+    return model_spec
+
+def get_fireworks_url(model_spec: ModelSpec, operation: str = "text_to_image") -> str:
+    """The Fireworks.ai endpoint for a model: `text_to_image` or `image_to_image`."""
+    return f"{settings.FIREWORKS_API_BASE_URL}{model_spec.path}/{operation}"
+
+async def generate_single_image(
+    client: httpx.AsyncClient,
+    url: str,
+    prompt: str,
+    negative_prompt: Optional[str],
+    width: int,
+    height: int,
+    seed: int,
+) -> bytes:
+    """Requests one image from Fireworks.ai and returns the raw PNG bytes."""
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "image/png",
+        "Authorization": f"Bearer {settings.FIREWORKS_API_KEY}",
+    }
+    payload = {
+        "prompt": prompt,
+        "negative_prompt": negative_prompt,
+        "width": width,
+        "height": height,
+        "samples": 1,
+        "seed": seed
+    }
+    logger.debug("Sending request to Fireworks.ai", extra={"payload": payload})
+    # Timeouts come from the shared client (see FIREWORKS_READ_TIMEOUT in Config)
+    response = await client.post(url, headers=headers, json=payload)
+    logger.debug("Received response from Fireworks.ai", extra={"status": response.status_code})
+    response.raise_for_status()
+    return await response.aread()
+
+async def generate_image_from_reference(
+    client: httpx.AsyncClient,
+    url: str,
+    prompt: str,
+    negative_prompt: Optional[str],
+    reference: bytes,
+    strength: float,
+    seed: int,
+) -> bytes:
+    """
+    Requests one image-to-image result from Fireworks.ai and returns the raw PNG bytes.
+    The output has the reference's dimensions, so it must already be fitted to the
+    requested aspect ratio.
+    """
+    headers = {
+        "Accept": "image/png",
+        "Authorization": f"Bearer {settings.FIREWORKS_API_KEY}",
+    }
+    data = {
+        "prompt": prompt,
+        "init_image_mode": "IMAGE_STRENGTH",
+        "image_strength": str(strength),
+        "samples": "1",
+        "seed": str(seed),
+    }
+    if negative_prompt:
+        data["negative_prompt"] = negative_prompt
+    logger.debug("Sending image-to-image request to Fireworks.ai", extra={"payload": data, "reference_bytes": len(reference)})
+    response = await client.post(
+        url,
+        headers=headers,
+        data=data,
+        files={"init_image": ("reference.jpeg", reference, "image/jpeg")},
+    )
+    logger.debug("Received response from Fireworks.ai", extra={"status": response.status_code})
+    response.raise_for_status()
+    return await response.aread()
+
+def parse_batch_response(data: Union[dict, list]) -> List[bytes]:
+    """
+    Extracts the images from a JSON multi-sample response. Accepts both a list of
+    `{"base64": ...}` samples and a single object with a `base64` list.
+    """
+    samples = data if isinstance(data, list) else [data]
+    images = []
+    for sample in samples:
+        encoded = sample.get("base64") if isinstance(sample, dict) else None
+        if isinstance(encoded, str):
+            encoded = [encoded]
+        for item in encoded or []:
+            images.append(base64.b64decode(item))
+    return images
+
+async def generate_image_batch(
+    client: httpx.AsyncClient,
+    url: str,
+    prompt: str,
+    negative_prompt: Optional[str],
+    width: int,
+    height: int,
+    seed: int,
+    samples: int,
+) -> List[bytes]:
+    """Requests `samples` images from Fireworks.ai in a single call."""
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+        "Authorization": f"Bearer {settings.FIREWORKS_API_KEY}",
+    }
+    payload = {
+        "prompt": prompt,
+        "negative_prompt": negative_prompt,
+        "width": width,
+        "height": height,
+        "samples": samples,
+        "seed": seed
+    }
+    logger.debug("Sending batch request to Fireworks.ai", extra={"payload": payload})
+    response = await client.post(url, headers=headers, json=payload)
+    logger.debug("Received batch response from Fireworks.ai", extra={"status": response.status_code})
+    response.raise_for_status()
+    return parse_batch_response(response.json())
+
+@dataclass
+class GenerationContext:
+    """Everything a generation job needs once the request has been validated."""
+    image_in: schemas.ImageCreate
+    model_spec: ModelSpec
+    fireworks_api_url: str
+    owner_id: Optional[str]
+    response_format: str
+    blob_base_url: str
+    use_cache: bool = False
+    num_images: int = 4
+    # Retries and hedged requests this generation may still spend
+    retry_budget: RetryBudget = field(default_factory=lambda: RetryBudget(0))
+    # Image-to-image: the reference's blob key, and its bytes fitted to the output
+    # size once the job has prepared them
+    reference_key: Optional[str] = None
+    reference_strength: float = 0.0
+    reference_image: Optional[bytes] = None
+
+    @property
+    def model_path(self) -> str:
+        return self.model_spec.path
+
+    @property
+    def use_batching(self) -> bool:
+        # Cached generations stay per-image so every image has its own cache entry;
+        # image-to-image calls return a single image.
+        return (
+            self.model_spec.max_samples > 1 and self.num_images > 1
+            and not self.use_cache and self.reference_key is None
+        )
+
+    @property
+    def reference_variation(self) -> Optional[Tuple[str, float]]:
+        """Part of the cache, flight and seed keys: identical prompts with different references differ."""
+        return (self.reference_key, self.reference_strength) if self.reference_key else None
 
+def get_response_format(image_in: schemas.ImageCreate) -> str:
+    response_format = image_in.response_format or settings.IMAGE_RESPONSE_FORMAT
+    if response_format not in ("url", "b64_json"):
+        raise HTTPException(status_code=400, detail=f"Unsupported response_format: {response_format}")
+    return response_format
+
+def get_blob_base_url(request: Request) -> str:
+    """Base URL for links to stored images; a CDN can be configured through BLOB_BASE_URL."""
+    if settings.BLOB_BASE_URL:
+        return settings.BLOB_BASE_URL.rstrip("/")
+    return f"{str(request.base_url).rstrip('/')}{settings.API_V1_STR}/images/blob"
+
+# --- Prompt-level result cache (opt-in, see GENERATION_CACHE_* in Config) ---
+# Keyed by (model path, prompt, negative prompt, width, height, seed, reference). Values are
+# the image bytes, or just the blob key when the cache is backed by the blob store.
+generation_cache: LRUCache[tuple, Union[bytes, str]] = LRUCache(
+    max_entries=settings.GENERATION_CACHE_MAX_ENTRIES,
+    ttl=settings.GENERATION_CACHE_TTL,
+    max_weight=settings.GENERATION_CACHE_MAX_BYTES,
+    weigher=len,
+)
+
+MAX_SEED = 4294967295
+
+def derive_seeds(ctx: GenerationContext, prompt: str, width: int, height: int, num_images: int) -> List[int]:
+    """
+    Picks one seed per image. An explicit request seed gives seed, seed+1, ...;
+    cached generations derive the base seed from the request itself, so identical
+    requests map to identical cache keys. Otherwise seeds are random, as before.
+    """
+    base_seed = ctx.image_in.seed
+    if base_seed is None and ctx.use_cache:
+        reference = ctx.reference_variation
+        reference_part = f"\0{reference[0]}:{reference[1]}" if reference else ""
+        digest = hashlib.sha256(
+            f"{ctx.model_path}\0{prompt}\0{ctx.image_in.negative_prompt or ''}\0{width}x{height}{reference_part}".encode("utf-8")
+        ).digest()
+        base_seed = int.from_bytes(digest[:4], "big")
+    if base_seed is None:
+        return [random.randint(1, MAX_SEED) for _ in range(num_images)]
+    return [(base_seed + i - 1) % MAX_SEED + 1 for i in range(num_images)]
+
+async def call_upstream(ctx: GenerationContext, latency_key: str, func: Callable[[], Awaitable[T]]) -> T:
+    """
+    Runs an upstream call inside the model's concurrency limiter, with jittered
+    retries and hedging against the latency history tracked under `latency_key`.
+    """
+    limiter = get_limiter(ctx.model_path)
+    tracker = get_latency_tracker(latency_key)
+
+    async def observed() -> T:
+        # One observation per actual HTTP call, so retries, hedges and 429s all count.
+        # Runs inside the limiter slot, so the hedge latencies exclude time spent queueing.
+        status = "error"
+        start = time.perf_counter()
+        try:
+            result = await func()
+            status = "2xx"
+            tracker.record(time.perf_counter() - start)
+            return result
+        except httpx.HTTPStatusError as e:
+            status = str(e.response.status_code)
+            raise
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            UPSTREAM_REQUESTS.inc(model=ctx.model_path, status=status)
+            UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - start, model=ctx.model_path)
+
+    return await call_with_resilience(
+        lambda: limiter.run(observed),
+        tracker=tracker,
+        budget=ctx.retry_budget,
+        # A call that is slow because it queued behind others is not helped by
+        # queueing a duplicate; hedge only while the limiter has no waiters.
+        can_hedge=lambda: limiter.waiting == 0,
+    )
+
+# --- Single-flight: concurrent identical generations share one upstream call per image ---
+generation_flights = SingleFlight()
+
+metrics.stats_collector("generation_cache", "Generation result cache size (entries, weight).", generation_cache.stats, counters=CACHE_COUNTERS)
+metrics.stats_collector(
+    "generation_single_flight", "Coalesced generations currently in flight.", generation_flights.stats, counters=SINGLE_FLIGHT_COUNTERS
+)
+
+def has_fixed_seeds(ctx: GenerationContext) -> bool:
+    return ctx.image_in.seed is not None or ctx.use_cache
+
+async def generate_coalesced_image(
+    ctx: GenerationContext,
+    client: httpx.AsyncClient,
+    prompt: str,
+    width: int,
+    height: int,
+    seed: int,
+    index: int,
+) -> bytes:
+    """
+    `generate_single_image`, coalesced with identical in-flight requests.
+    With fixed seeds the key includes the seed; with random seeds it includes the
+    image's slot instead, so a double-submitted request maps onto the same calls.
+    """
+    negative_prompt = ctx.image_in.negative_prompt
+    if ctx.reference_image is not None:
+        upstream = lambda: generate_image_from_reference(
+            client, ctx.fireworks_api_url, prompt, negative_prompt, ctx.reference_image, ctx.reference_strength, seed
+        )
+    else:
+        upstream = lambda: generate_single_image(client, ctx.fireworks_api_url, prompt, negative_prompt, width, height, seed)
+    call = lambda: call_upstream(ctx, ctx.model_path, upstream)
+    if not settings.GENERATION_SINGLE_FLIGHT:
+        return await call()
+    variation = ("seed", seed) if has_fixed_seeds(ctx) else ("slot", index)
+    flight_key = (ctx.model_path, prompt, negative_prompt, width, height, variation, ctx.reference_variation)
+    return await generation_flights.do(flight_key, call)
+
+async def generate_cached_image(
+    ctx: GenerationContext,
+    client: httpx.AsyncClient,
+    prompt: str,
+    width: int,
+    height: int,
+    seed: int,
+    index: int,
+) -> bytes:
+    """`generate_single_image` behind the prompt-level cache when the request opted in."""
+    negative_prompt = ctx.image_in.negative_prompt
+    if not ctx.use_cache:
+        return await generate_coalesced_image(ctx, client, prompt, width, height, seed, index)
+
+    cache_key = (ctx.model_path, prompt, negative_prompt, width, height, seed, ctx.reference_variation)
+    cached = generation_cache.get(cache_key)
+    if isinstance(cached, bytes):
+        return cached
+    if cached is not None:
+        image_bytes = await blob_store.get(cached)
+        if image_bytes is not None:
+            return image_bytes
+
+    image_bytes = await generate_coalesced_image(ctx, client, prompt, width, height, seed, index)
+    if settings.GENERATION_CACHE_BLOB_BACKED:
+        generation_cache.set(cache_key, await blob_store.put(image_bytes))
+    else:
+        generation_cache.set(cache_key, image_bytes)
+    return image_bytes
+
+async def generate_coalesced_batch(
+    ctx: GenerationContext,
+    client: httpx.AsyncClient,
+    prompt: str,
+    width: int,
+    height: int,
+    seed: int,
+    start: int,
+    count: int,
+) -> List[bytes]:
+    """`generate_image_batch`, coalesced with identical in-flight batches."""
+    negative_prompt = ctx.image_in.negative_prompt
+    call = lambda: call_upstream(
+        ctx, f"{ctx.model_path}:batch{count}",
+        lambda: generate_image_batch(client, ctx.fireworks_api_url, prompt, negative_prompt, width, height, seed, count),
+    )
+    if not settings.GENERATION_SINGLE_FLIGHT:
+        return await call()
+    variation = ("seed", seed) if has_fixed_seeds(ctx) else ("slot", start)
+    flight_key = (ctx.model_path, prompt, negative_prompt, width, height, variation, "batch", count)
+    return await generation_flights.do(flight_key, call)
+
+async def iter_generation(ctx: GenerationContext) -> AsyncIterator[Tuple[int, Union[bytes, Exception]]]:
+    """
+    Starts all upstream calls in parallel and yields `(index, image_bytes_or_exception)`
+    for each image as soon as it finishes, fastest first.
+    Models that support multi-sample calls get one call per `max_samples` images;
+    all others fan out one call per image.
+    """
+    image_in = ctx.image_in
+    num_images = ctx.num_images
+    final_prompt = construct_prompt(image_in)
+    width, height = parse_aspect_ratio(image_in.aspect_ratio)
+    seeds = derive_seeds(ctx, final_prompt, width, height, num_images)
+    if ctx.reference_key is not None and ctx.reference_image is None:
+        with GENERATION_STAGE_SECONDS.time(stage="reference"):
+            ctx.reference_image = await imaging.get_reference(ctx.reference_key, width, height)
+        if ctx.reference_image is None:
+            raise HTTPException(status_code=400, detail="Reference image not found.")
+
+    # --- Reuse the application-wide pooled client instead of opening one per request ---
+    client = http_client.fireworks_client()
+
+    async def single(index: int):
+        try:
+            return [(index, await generate_cached_image(ctx, client, final_prompt, width, height, seeds[index], index))]
+        except Exception as e:
+            return [(index, e)]
+
+    async def batch(start: int, count: int):
+        indices = range(start, start + count)
+        try:
+            images = await generate_coalesced_batch(ctx, client, final_prompt, width, height, seeds[start], start, count)
+        except Exception as e:
+            return [(i, e) for i in indices]
+        missing = ValueError("The image generation service returned fewer images than requested.")
+        return [(i, images[i - start] if i - start < len(images) else missing) for i in indices]
+
+    if ctx.use_batching:
+        step = ctx.model_spec.max_samples
+        tasks = [asyncio.create_task(batch(start, min(step, num_images - start))) for start in range(0, num_images, step)]
+        logger.debug("Generating images in batched calls", extra={"num_images": num_images, "calls": len(tasks)})
+    else:
+        tasks = [asyncio.create_task(single(i)) for i in range(num_images)]
+        logger.debug("Generating images in parallel calls", extra={"num_images": num_images, "calls": len(tasks)})
     try:
-        await verify_turnstile(image_in.turnstile_token)
-        print("[BACKEND] images.py: Turnstile verification successful.")
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def deliver_image(ctx: GenerationContext, image_bytes: bytes) -> Union[str, RawJSON]:
+    """
+    Turns generated image bytes into what the client receives: a link to the
+    content-addressed blob, or a legacy Base64 data URL. Data URLs are kept as
+    pre-encoded JSON, so the megabytes of Base64 are never decoded into a Python
+    string or escaped again when the response is serialized.
+    """
+    if ctx.response_format == "b64_json":
+        with GENERATION_STAGE_SECONDS.time(stage="encode"):
+            return RawJSON.data_url("image/png", base64.b64encode(image_bytes))
+    with GENERATION_STAGE_SECONDS.time(stage="store"):
+        key = await blob_store.put(image_bytes)
+    # WebP/AVIF encodings and thumbnails are produced off the request path.
+    imaging.schedule_variants(key, image_bytes)
+    return f"{ctx.blob_base_url}/{key}"
+
+async def save_image_records(ctx: GenerationContext, image_urls: List[str]) -> None:
+    """
+    Persists references to stored images in the owner's history, in one commit.
+    By now the images are stored and may already have been delivered, so a failed
+    history write is logged rather than failing (and refunding) the generation.
+    """
+    if not ctx.owner_id or ctx.response_format != "url":
+        return
+    with GENERATION_STAGE_SECONDS.time(stage="save_records"):
+        try:
+            async with AsyncSessionLocal() as db:
+                await crud.async_image.create_many_with_owner(
+                    db, obj_in=ctx.image_in, owner_id=ctx.owner_id, image_urls=list(dict.fromkeys(image_urls))
+                )
+        except Exception as e:
+            logger.error(
+                f"Failed to save {len(image_urls)} image(s) to the history of user {ctx.owner_id}: {type(e).__name__} - {e}",
+                extra={"image_urls": image_urls},
+            )
+
+def generation_error(exceptions: List[Exception]) -> HTTPException:
+    """Builds the client-facing error for a generation where every upstream call failed."""
+    first_exception = exceptions[0] if exceptions else None
+    logger.error(f"All image generation tasks failed. First exception: {type(first_exception).__name__} - {first_exception}")
+    if isinstance(first_exception, UpstreamBusy):
+        return HTTPException(status_code=503, detail=str(first_exception))
+    if isinstance(first_exception, httpx.HTTPStatusError):
+        return HTTPException(status_code=502, detail=f"Error from image generation service: {first_exception.response.text}")
+    return HTTPException(status_code=500, detail="Failed to generate any images from the service.")
+
+async def run_generation(ctx: GenerationContext, charge: "CreditCharge") -> dict:
+    """
+    Generates the requested images and returns the ones that succeeded as blob URLs
+    or data URLs; the share of the cost for failed images is refunded.
+    Raises HTTPException if every upstream call failed.
+    """
+    results = {}
+    exceptions = []
+    with GENERATION_STAGE_SECONDS.time(stage="upstream"):
+        async for index, result in iter_generation(ctx):
+            if isinstance(result, Exception):
+                exceptions.append(result)
+            else:
+                results[index] = result
+
+    if not results:
+        raise generation_error(exceptions)
+
+    logger.info("Generation completed", extra={"images": len(results), "requested": ctx.num_images})
+    image_urls = [await deliver_image(ctx, results[i]) for i in sorted(results)]
+    await save_image_records(ctx, image_urls)
+
+    if exceptions:
+        logger.warning(f"Only {len(image_urls)} of {ctx.num_images} images were generated; refunding the rest.")
+        await charge.refund(charge.amount * len(exceptions) // ctx.num_images)
+
+    return {"images": image_urls}
+
+class CreditCharge:
+    """
+    A credit reservation on the ledger for one generation.
+    It settles exactly once: `commit` keeps the credits, `refund` returns all or part
+    of them, and any later call is a no-op. The ledger enforces the same across
+    processes, and reservations orphaned by a crashed worker are released by the sweeper.
+    """
+
+    def __init__(self, user_id: Optional[str], amount: int):
+        self.user_id = user_id
+        self.amount = amount
+        self.reference = new_reference()
+        self.refunded = 0
+        self.settled = False
+
+    @classmethod
+    async def reserve(cls, db: AsyncSession, user: UserIdentity, amount: int) -> "CreditCharge":
+        """Takes `amount` credits from `user` in a single conditional update, or raises 402."""
+        charge = cls(user_id=user.id, amount=amount)
+        with GENERATION_STAGE_SECONDS.time(stage="credit_reserve"):
+            new_credits = await crud.async_credit.reserve(db, user_id=user.id, amount=amount, reference=charge.reference)
+        if new_credits is None:
+            balance = await crud.async_credit.get_balance(db, user_id=user.id)
+            logger.info("Insufficient credits", extra={"user_id": user.id, "cost": amount, "balance": balance})
+            raise HTTPException(
+                status_code=402, # 402 Payment Required
+                detail=f"Insufficient credits. This generation costs {amount} credits, but you only have {balance or 0}.",
+            )
+        logger.info("Reserved credits", extra={"user_id": user.id, "amount": amount, "balance": new_credits})
+        return charge
+
+    @property
+    def charged(self) -> int:
+        return self.amount - self.refunded
+
+    async def commit(self) -> None:
+        await self._settle(refund=0)
+
+    async def refund(self, amount: Optional[int] = None) -> None:
+        await self._settle(refund=self.amount if amount is None else amount)
+
+    async def _settle(self, refund: int) -> None:
+        if not self.user_id or self.settled:
+            return
+        # Mark as settled before awaiting so concurrent calls can't settle twice.
+        self.settled = True
+        refund = max(0, min(refund, self.amount))
+        try:
+            with GENERATION_STAGE_SECONDS.time(stage="credit_settle"):
+                async with AsyncSessionLocal() as settle_db:
+                    settled = await crud.async_credit.settle(
+                        settle_db, user_id=self.user_id, reference=self.reference, amount=self.amount, refund=refund
+                    )
+        except Exception as e:
+            logger.error(f"Failed to settle credit reservation {self.reference}, leaving it to the sweeper: {type(e).__name__} - {e}")
+            return
+        if not settled:
+            logger.warning(f"Credit reservation {self.reference} was already settled.")
+            return
+        self.refunded = refund
+        if refund:
+            logger.info("Refunded credits", extra={"user_id": self.user_id, "amount": refund})
+
+async def reserve_verified_charge(
+    turnstile: Awaitable[None],
+    db: AsyncSession,
+    current_user: Optional[UserIdentity],
+    cost: int,
+) -> CreditCharge:
+    """
+    Awaits Turnstile verification while the credits are reserved concurrently.
+    The reservation is only kept once verification has passed: if it fails, or the
+    request is cancelled, the reservation is refunded before the error propagates.
+    An insufficient balance fails straight away. A verification already sent to
+    Cloudflare still completes and is remembered (see `turnstile_cache`), so the
+    client can retry with the same token after topping up.
+    """
+    turnstile = asyncio.ensure_future(turnstile)
+    if not current_user or cost <= 0:
+        await turnstile
+        return CreditCharge(user_id=None, amount=0)
+
+    reservation = asyncio.ensure_future(CreditCharge.reserve(db, current_user, cost))
+    try:
+        await asyncio.wait({turnstile, reservation}, return_when=asyncio.FIRST_EXCEPTION)
+        if reservation.done() and reservation.exception() is not None:
+            turnstile.cancel()
+            return await reservation
+        await turnstile
+        return await reservation
+    except BaseException:
+        turnstile.cancel()
+        await discard_reservation(reservation)
+        raise
+
+async def discard_reservation(reservation: "asyncio.Future[CreditCharge]") -> None:
+    """
+    Refunds a reservation that must not be kept, once it has completed (one that
+    failed reserved nothing). If the request is cancelled while waiting, the refund
+    happens in the background instead of being left to the sweeper.
+    """
+    try:
+        charge = await asyncio.shield(reservation)
+    except asyncio.CancelledError:
+        reservation.add_done_callback(schedule_refund)
+        raise
+    except Exception:
+        return
+    await charge.refund()
+
+_background_refunds: Set[asyncio.Task] = set()
+
+def schedule_refund(reservation: "asyncio.Future[CreditCharge]") -> None:
+    if reservation.cancelled() or reservation.exception() is not None:
+        return
+    task = asyncio.create_task(reservation.result().refund())
+    _background_refunds.add(task)
+    task.add_done_callback(_background_refunds.discard)
+
+async def run_streamed_generation(
+    ctx: GenerationContext,
+    charge: CreditCharge,
+    events: asyncio.Queue,
+) -> dict:
+    """
+    Generates the requested images, publishing each one to `events` as soon as it is ready.
+    As in `run_generation`, the share of the cost for failed images is refunded.
+    """
+    num_images = ctx.num_images
+    image_urls = []
+    errors = []
+    async for index, result in iter_generation(ctx):
+        if isinstance(result, Exception):
+            errors.append(result)
+            continue
+        image_url = await deliver_image(ctx, result)
+        image_urls.append(image_url)
+        events.put_nowait(("image", {"index": index, "image": image_url}))
+
+    if not image_urls:
+        raise generation_error(errors)
+    await save_image_records(ctx, image_urls)
+
+    if errors:
+        await charge.refund(charge.amount * len(errors) // num_images)
+
+    summary = {
+        "images": len(image_urls),
+        "failed": len(errors),
+        "errors": [str(e) for e in errors],
+        "credits_charged": charge.charged,
+    }
+    events.put_nowait(("summary", summary))
+    events.put_nowait(None)
+    return {"images": image_urls}
+
+# --- Image-to-image references ---
+# Multipart framing (boundary lines, part headers) allowed on top of the image itself.
+REFERENCE_UPLOAD_OVERHEAD = 64 * 1024
+
+reference_upload_quota = ClientQuota(settings.REFERENCE_UPLOAD_QUOTA, settings.REFERENCE_UPLOAD_QUOTA_WINDOW)
+
+def reference_too_large() -> HTTPException:
+    limit_mb = settings.REFERENCE_IMAGE_MAX_BYTES / (1024 * 1024)
+    return HTTPException(status_code=413, detail=f"Reference image is too large. The limit is {limit_mb:g} MB.")
+
+async def read_limited_body(request: Request, limit: int) -> AsyncIterator[bytes]:
+    """The request body as it arrives, failing with 413 as soon as more than `limit` bytes have been sent."""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise reference_too_large()
+        yield chunk
+
+async def read_reference_upload(request: Request) -> bytes:
+    """
+    Reads the `image` file of a multipart/form-data upload. The body is parsed as it
+    streams in, with large files spilling to a temporary file rather than memory,
+    and an oversized upload is refused by its Content-Length or as soon as the
+    limit is crossed instead of after it has been received in full.
+    """
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=415, detail="Expected a multipart/form-data upload with an `image` file.")
+    limit = settings.REFERENCE_IMAGE_MAX_BYTES + REFERENCE_UPLOAD_OVERHEAD
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > limit:
+        raise reference_too_large()
+
+    parser = MultiPartParser(request.headers, read_limited_body(request, limit), max_files=1, max_fields=8)
+    try:
+        form = await parser.parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    try:
+        upload = form.get("image")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing `image` file.")
+        data = await upload.read(settings.REFERENCE_IMAGE_MAX_BYTES + 1)
+    finally:
+        await form.close()
+    if len(data) > settings.REFERENCE_IMAGE_MAX_BYTES:
+        raise reference_too_large()
+    return data
+
+def decode_reference_b64(value: str) -> bytes:
+    """Decodes a legacy `image_b64` reference, given as plain Base64 or as a data URL."""
+    encoded = value.split(",", 1)[1] if value.startswith("data:") else value
+    if len(encoded) * 3 // 4 > settings.REFERENCE_IMAGE_MAX_BYTES:
+        raise reference_too_large()
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="image_b64 is not valid Base64.")
+
+async def store_reference(data: bytes) -> str:
+    """
+    Validates a reference image in the process pool and stores it, returning its
+    blob key. Blobs are keyed by content, so an image that is already stored is
+    neither decoded nor written again.
+    """
+    key = content_hash(data)
+    if await blob_store.exists(key):
+        return key
+    try:
+        await imaging.run_in_pool(imaging.inspect_image, data, settings.REFERENCE_IMAGE_MAX_PIXELS)
+    except Exception as e:
+        logger.info(f"Rejected reference image: {type(e).__name__} - {e}")
+        raise HTTPException(status_code=400, detail="The reference image could not be read or has too many pixels.")
+    return await blob_store.put(data)
+
+async def resolve_reference(image_in: schemas.ImageCreate) -> Optional[str]:
+    """The blob key of the request's image-to-image reference, if it has one."""
+    if image_in.reference_hash:
+        if not await blob_store.exists(image_in.reference_hash):
+            raise HTTPException(status_code=400, detail="Reference image not found. Upload it to /images/references/ first.")
+        return image_in.reference_hash
+    if image_in.image_b64:
+        return await store_reference(decode_reference_b64(image_in.image_b64))
+    return None
+
+async def submit_generation_job(
+    request: Request,
+    image_in: schemas.ImageCreate,
+    db: AsyncSession,
+    current_user: Optional[UserIdentity],
+    turnstile: Awaitable[None],
+    stream_events: Optional[asyncio.Queue] = None,
+) -> Job:
+    """
+    Validates the request, reserves credits and queues the generation job.
+    `turnstile` is the verification started by `start_turnstile_verification`;
+    nothing is charged or queued unless it passes.
+    The job owns the reservation from here on: it is committed when the job succeeds
+    and refunded by its failure hook otherwise, even if the client has gone away.
+    When `stream_events` is given, images are published to it as they complete.
+    """
+    log_generation_request(image_in)
+    if not settings.FIREWORKS_API_KEY or settings.FIREWORKS_API_KEY == "your_fireworks_api_key_here":
+        logger.critical("Fireworks API key is not configured on the server. Set FIREWORKS_API_KEY in the .env file.")
+        raise HTTPException(status_code=500, detail="Fireworks API key is not configured. Please contact administrator.")
+
+    # Checked up front so requests without a token never write to the credit ledger.
+    if not image_in.turnstile_token:
+        raise HTTPException(status_code=400, detail="Turnstile token is missing.")
+
+    model_id = image_in.model or "tt-flux1-schnell"
+    generation_cost = get_generation_cost(current_user, model_id, image_in.num_images)
+    model_spec = get_model_spec(model_id)
+    response_format = get_response_format(image_in)
+
+    # --- Verify Turnstile and reserve credits (if applicable) concurrently ---
+    try:
+        charge = await reserve_verified_charge(turnstile, db, current_user, generation_cost)
     except HTTPException as e:
-        print(f"[BACKEND] images.py: ERROR: Turnstile verification failed: {e.detail}")
+        logger.info(f"Pre-generation checks failed: {e.detail}")
         raise e
 
-    # --- Deduct credits if applicable ---
-    if current_user and generation_cost > 0:
-        print(f"[BACKEND] images.py: Attempting to deduct {generation_cost} credits from user {current_user.id}...")
-        current_user.credits -= generation_cost
-        current_user.credits_spent += generation_cost
-        db.commit()
-        db.refresh(current_user)
-        print(f"[BACKEND] images.py: Deducted {generation_cost} credits. New balance: {current_user.credits}")
+    # An inline reference is decoded and stored only for verified, paid requests.
+    # Anything that fails from here until the job is queued refunds the reservation.
+    try:
+        reference_key = await resolve_reference(image_in)
+        fireworks_api_url = get_fireworks_url(model_spec, "image_to_image" if reference_key else "text_to_image")
+        logger.debug("Targeting Fireworks.ai endpoint", extra={"url": fireworks_api_url})
+        ctx = GenerationContext(
+            image_in=image_in,
+            model_spec=model_spec,
+            fireworks_api_url=fireworks_api_url,
+            owner_id=current_user.id if current_user else None,
+            response_format=response_format,
+            blob_base_url=get_blob_base_url(request),
+            use_cache=image_in.cache if image_in.cache is not None else settings.GENERATION_CACHE_DEFAULT,
+            num_images=image_in.num_images,
+            retry_budget=RetryBudget(settings.UPSTREAM_EXTRA_CALLS_PER_IMAGE * image_in.num_images),
+            reference_key=reference_key,
+            reference_strength=(
+                image_in.reference_strength if image_in.reference_strength is not None
+                else settings.REFERENCE_IMAGE_DEFAULT_STRENGTH
+            ),
+        )
+    except BaseException:
+        await charge.refund()
+        raise
+
+    async def on_failure(job: Job) -> None:
+        await charge.refund()
+        if stream_events is not None:
+            stream_events.put_nowait(("error", {"status": job.error_status, "detail": job.error}))
+            stream_events.put_nowait(None)
+
+    async def run_job() -> dict:
+        if stream_events is not None:
+            result = await run_streamed_generation(ctx, charge, stream_events)
+        else:
+            result = await run_generation(ctx, charge)
+        await charge.commit()
+        return result
 
     try:
-        final_prompt = construct_prompt(image_in)
-        width, height = parse_aspect_ratio(image_in.aspect_ratio)
-        
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "image/png",
-            "Authorization": f"Bearer {settings.FIREWORKS_API_KEY}",
-        }
-        
-        async def generate_single_image(client: httpx.AsyncClient, url: str):
-            payload = {
-                "prompt": final_prompt,
-                "negative_prompt": image_in.negative_prompt,
-                "width": width,
-                "height": height,
-                "samples": 1,
-                "seed": random.randint(1, 4294967295)
-            }
-            print(f"[BACKEND] images.py: Sending request to Fireworks.ai with payload: {json.dumps(payload, indent=2)}")
-            response = await client.post(url, headers=headers, json=payload, timeout=180.0)
-            print(f"[BACKEND] images.py: Received response from Fireworks.ai with status: {response.status_code}")
-            response.raise_for_status()
-            image_bytes = await response.aread()
-            return base64.b64encode(image_bytes).decode('utf-8')
-
-        async with httpx.AsyncClient() as client:
-            generation_tasks = [generate_single_image(client, fireworks_api_url) for _ in range(4)]
-            print(f"[BACKEND] images.py: Generating 4 images in parallel with Fireworks.ai...")
-            base64_images_results = await asyncio.gather(*generation_tasks, return_exceptions=True)
-            
-            successful_images_base64 = [img for img in base64_images_results if not isinstance(img, Exception)]
+        return await job_queue.submit(
+            run_job,
+            owner_id=ctx.owner_id,
+            on_failure=on_failure,
+        )
+    except JobQueueFull as e:
+        await charge.refund()
+        raise HTTPException(status_code=503, detail=str(e))
 
-            if not successful_images_base64:
-                first_exception = next((res for res in base64_images_results if isinstance(res, Exception)), None)
-                print(f"[BACKEND] images.py: ERROR: All image generation tasks failed. First exception: {first_exception}")
-                raise HTTPException(status_code=500, detail="Failed to generate any images from the service.")
+async def get_owned_job(job_id: str, current_user: Optional[UserIdentity]) -> Job:
+    """Looks up a job, hiding jobs that belong to another user."""
+    job = await job_queue.get(job_id)
+    if not job or (job.owner_id and (not current_user or current_user.id != job.owner_id)):
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
 
-            print(f"[BACKEND] images.py: Job completed successfully. Returning {len(successful_images_base64)} base64 images.")
+def job_to_schema(job: Job) -> schemas.JobRead:
+    return schemas.JobRead(
+        id=job.id,
+        status=job.status.value,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        error=job.error,
+    )
 
-            # --- KEY CHANGE: Return Base64 data URLs directly ---
-            image_data_urls = [f"data:image/png;base64,{b64}" for b64 in successful_images_base64]
-            
-            # Pad the results if some failed, to always return 4 images if at least one succeeded
-            if image_data_urls and len(image_data_urls) < 4:
-                print(f"[BACKEND] images.py: WARNING: Only {len(image_data_urls)} of 4 images were generated. Duplicating to fill.")
-                while len(image_data_urls) < 4:
-                    image_data_urls.append(image_data_urls[0])
-
-            return JSONResponse(content={"images": image_data_urls})
-
-    except httpx.HTTPStatusError as e:
-        # Revert credits if the API call fails
-        if current_user and generation_cost > 0:
-            current_user.credits += generation_cost
-            current_user.credits_spent -= generation_cost
-            db.commit()
-            print(f"[BACKEND] images.py: Reverted {generation_cost} credits for user {current_user.id} due to API failure.")
-        print(f"[BACKEND] images.py: ERROR: HTTP error occurred while contacting Fireworks.ai: {e.response.status_code} - {e.response.text}")
-        raise HTTPException(status_code=502, detail=f"Error from image generation service: {e.response.text}")
-    except Exception as e:
-        # Revert credits for any other unexpected error
-        if current_user and generation_cost > 0:
-            current_user.credits += generation_cost
-            current_user.credits_spent -= generation_cost
-            db.commit()
-            print(f"[BACKEND] images.py: Reverted {generation_cost} credits for user {current_user.id} due to an unexpected error.")
-        print(f"[BACKEND] images.py: ERROR: An unexpected error occurred: {e}")
+@router.post("/generate/", response_class=ORJSONResponse, summary="Generate Image with Fireworks.ai FLUX.1")
+async def generate_image(
+    request: Request, # Add Request to the function signature
+    image_in: schemas.ImageCreate, 
+    turnstile: asyncio.Task = Depends(start_turnstile_verification), # Declared first so it overlaps with auth
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Optional[UserIdentity] = Depends(deps.get_current_user_optional) # <-- CORRECT way to use dependency
+):
+    """
+    Generate an image based on the provided prompt using Fireworks.ai FLUX.1 API.
+    Images are stored by content hash and returned as `/images/blob/{hash}` URLs
+    (or as Base64 data URLs with `response_format="b64_json"`).
+    With a `reference_hash` from `POST /references/` the images are generated
+    image-to-image, fitted to the requested aspect ratio.
+    The work runs as a queued job; this endpoint simply waits for it to finish.
+    When JOB_WORKERS jobs are running and JOB_MAX_PENDING more are waiting, the
+    request is rejected with 503 and can be retried.
+    """
+    job = await submit_generation_job(request, image_in, db, current_user, turnstile)
+    job = await job_queue.wait(job.id)
+    if job is None:
         raise HTTPException(status_code=500, detail="An unexpected error occurred during image generation.")
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=job.error_status or 500, detail=job.error)
+    with GENERATION_STAGE_SECONDS.time(stage="serialize"):
+        response = ORJSONResponse(content=job.result)
+    return response
+
+def format_sse(event: str, data: dict) -> bytes:
+    return b"event: %s\ndata: %s\n\n" % (event.encode("ascii"), dumps(data))
+
+@router.post("/generate/stream/", summary="Generate images and stream each one as it completes")
+async def generate_image_stream(
+    request: Request,
+    image_in: schemas.ImageCreate,
+    turnstile: asyncio.Task = Depends(start_turnstile_verification),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Optional[UserIdentity] = Depends(deps.get_current_user_optional)
+):
+    """
+    Server-Sent Events variant of `/generate/`.
+    Emits a `job` event with the job id, an `image` event for every image as soon as it
+    is generated, then a final `summary` event with failures and the credits actually
+    charged (or an `error` event if nothing could be generated).
+    If the client disconnects, the job still finishes and its result stays available
+    from `GET /jobs/{job_id}/result`.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+    job = await submit_generation_job(request, image_in, db, current_user, turnstile, stream_events=events)
+
+    async def event_stream():
+        yield format_sse("job", {"id": job.id})
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield format_sse(*event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/jobs/", response_model=schemas.JobRead, status_code=202, summary="Submit an image generation job")
+async def create_generation_job(
+    request: Request,
+    image_in: schemas.ImageCreate,
+    turnstile: asyncio.Task = Depends(start_turnstile_verification),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Optional[UserIdentity] = Depends(deps.get_current_user_optional)
+):
+    """
+    Queue an image generation and return its job id immediately.
+    Poll `GET /jobs/{job_id}` for status and fetch images from `GET /jobs/{job_id}/result`.
+    """
+    job = await submit_generation_job(request, image_in, db, current_user, turnstile)
+    return job_to_schema(job)
+
+@router.get("/jobs/{job_id}", response_model=schemas.JobRead, summary="Get generation job status")
+async def read_generation_job(
+    job_id: str,
+    current_user: Optional[UserIdentity] = Depends(deps.get_current_user_optional)
+):
+    job = await get_owned_job(job_id, current_user)
+    return job_to_schema(job)
+
+@router.get("/jobs/{job_id}/result", summary="Get generation job result")
+async def read_generation_job_result(
+    job_id: str,
+    current_user: Optional[UserIdentity] = Depends(deps.get_current_user_optional)
+):
+    """
+    Returns the generated images once the job has succeeded.
+    Responds with 202 and the job status while it is still queued or running.
+    """
+    job = await get_owned_job(job_id, current_user)
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=job.error_status or 500, detail=job.error)
+    if job.status != JobStatus.SUCCEEDED:
+        return ORJSONResponse(status_code=202, content=job_to_schema(job).model_dump())
+    return ORJSONResponse(content=job.result)
+
+@router.post("/references/", response_model=schemas.ReferenceImageRead, summary="Upload a reference image for image-to-image")
+async def upload_reference_image(
+    request: Request,
+    current_user: Optional[UserIdentity] = Depends(deps.get_current_user_optional),
+    turnstile_token: Optional[str] = Header(None, alias="X-Turnstile-Token"),
+):
+    """
+    Stores a reference image sent as multipart/form-data in an `image` field, up to
+    REFERENCE_IMAGE_MAX_BYTES, and returns the `reference_hash` to pass with
+    generation requests. References are stored by SHA-256, so uploading the same
+    image again returns the same hash; clients can check `GET /references/{hash}`
+    and skip uploading an image the server already has. Generated images can be
+    used as references by their blob hash without uploading them at all.
+
+    Anonymous uploads need a Turnstile token in the X-Turnstile-Token header, and
+    every client is limited to REFERENCE_UPLOAD_QUOTA uploads per window. Both are
+    checked before the body is read.
+    """
+    if current_user is None and not turnstile_token:
+        raise HTTPException(status_code=401, detail="Sign in or send a Turnstile token in X-Turnstile-Token to upload reference images.")
+    client = f"user:{current_user.id}" if current_user else f"ip:{request.client.host if request.client else 'unknown'}"
+    retry_after = reference_upload_quota.consume(client)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many reference image uploads. Please try again later.",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    if current_user is None:
+        await verify_turnstile(turnstile_token)
+    data = await read_reference_upload(request)
+    return schemas.ReferenceImageRead(reference_hash=await store_reference(data))
+
+@router.get("/references/{reference_hash}", response_model=schemas.ReferenceImageRead, summary="Check whether a reference image is stored")
+async def read_reference_image(reference_hash: str):
+    if not is_valid_key(reference_hash) or not await blob_store.exists(reference_hash):
+        raise HTTPException(status_code=404, detail="Reference image not found.")
+    return schemas.ReferenceImageRead(reference_hash=reference_hash)
+
+@router.get("/history/", response_model=schemas.ImageHistoryPage, summary="List the current user's generated images")
+async def read_generation_history(
+    cursor: Optional[int] = Query(None, description="`next_cursor` from the previous page; omit for the newest images"),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserIdentity = Depends(deps.get_current_user),
+):
+    """
+    Returns the user's images newest first, one page at a time.
+    Pages are keyed by image id rather than an offset, so every page is an index
+    seek and images generated meanwhile never shift or repeat entries.
+    """
+    rows = await crud.async_image.get_history(db, owner_id=current_user.id, limit=limit + 1, before_id=cursor)
+    items = [schemas.ImageHistoryItem(id=row.id, prompt=row.prompt, image_url=row.image_url) for row in rows[:limit]]
+    next_cursor = items[-1].id if len(rows) > limit else None
+    return schemas.ImageHistoryPage(items=items, next_cursor=next_cursor)
+
+# Ranked results have to be sorted in full, so deep pages are refused rather than scanned.
+MAX_SEARCH_OFFSET = 1000
+
+@router.get("/search/", response_model=schemas.ImageSearchPage, summary="Search the current user's images by prompt")
+async def search_generation_history(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to find in prompts; the last one also matches as a prefix"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserIdentity = Depends(deps.get_current_user),
+):
+    """
+    Full-text search over the user's prompts, ranked by relevance.
+    Every word must match (in any form, e.g. "castle" finds "castles").
+    """
+    rows = await crud.async_image.search(db, owner_id=current_user.id, query=q, limit=limit + 1, offset=offset)
+    items = [
+        schemas.ImageSearchResult(id=row.id, prompt=row.prompt, image_url=row.image_url, score=row.score)
+        for row in rows[:limit]
+    ]
+    next_offset = offset + limit if len(rows) > limit and offset + limit <= MAX_SEARCH_OFFSET else None
+    return schemas.ImageSearchPage(items=items, next_offset=next_offset)
+
+def read_blob_head(path: str, size: int = 16) -> bytes:
+    with open(path, "rb") as f:
+        return f.read(size)
+
+@router.get("/blob/{blob_hash}", summary="Download a stored image by content hash")
+async def read_blob(
+    blob_hash: str,
+    request: Request,
+    fmt: Optional[str] = Query(None, alias="format", description="png, jpeg (progressive), webp or avif"),
+    size: Optional[int] = Query(None, description="Thumbnail size (longest side), one of IMAGE_THUMBNAIL_SIZES"),
+):
+    """
+    Serves a generated image. Blobs are immutable, so responses carry a strong ETag
+    and long-lived cache headers; Range requests are supported.
+    `format`/`size` select a transcoded variant. Without `format`, WebP or AVIF is
+    picked from the `Accept` header when that encoding is already available.
+    """
+    if not is_valid_key(blob_hash):
+        raise HTTPException(status_code=404, detail="Image not found.")
+    if fmt is not None and fmt not in imaging.supported_formats():
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+    if size is not None and size not in settings.IMAGE_THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"Unsupported size: {size}")
+
+    headers = {"cache-control": f"public, max-age={settings.BLOB_CACHE_MAX_AGE}, immutable"}
+    variant = None
+    if fmt is not None or size is not None:
+        variant = await imaging.get_or_create_variant(blob_hash, fmt or "png", size)
+        if variant is None:
+            raise HTTPException(status_code=404, detail="Image not found.")
+    else:
+        headers["vary"] = "Accept"
+        negotiated = imaging.negotiate_format(request.headers.get("accept"))
+        if negotiated:
+            candidate = imaging.variant_name(negotiated)
+            if await blob_store.exists(blob_hash, candidate):
+                variant = candidate
+            else:
+                # The variant is still being produced; serve the original but let caches revalidate soon.
+                headers["cache-control"] = "public, max-age=60"
+
+    etag = f'"{blob_hash}"' if variant is None else f'"{blob_hash}-{variant}"'
+    headers["etag"] = etag
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in if_none_match or if_none_match.strip() == "*":
+        if await blob_store.exists(blob_hash, variant):
+            return Response(status_code=304, headers=headers)
+
+    path = blob_store.local_path(blob_hash, variant)
+    if path:
+        media_type = sniff_content_type(await asyncio.to_thread(read_blob_head, path))
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    data = await blob_store.get(blob_hash, variant)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image not found.")
+    return Response(content=data, media_type=sniff_content_type(data), headers=headers)
 
 # --- Removed my-works and related endpoints as they are no longer needed ---
-# The frontend now manages history in localStorage.
\ No newline at end of file
+# The frontend now manages history in localStorage.
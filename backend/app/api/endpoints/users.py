@@ -1,17 +1,27 @@
+from dataclasses import asdict
+
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api import dependencies as deps
-from app.models.user import User
+from app.core.identity import UserIdentity
+from app.database import get_async_read_db
 import app.schemas as schemas
+import app.crud as crud
 
 router = APIRouter()
 
 @router.get("/me", response_model=schemas.UserRead)
-def read_users_me(current_user: User = Depends(deps.get_current_user)):
+async def read_users_me(
+    current_user: UserIdentity = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(get_async_read_db),
+):
     """
     Get current user.
+    The identity comes from the auth caches; only the credit balance is read from the
+    database (the read replica, if configured, so it may briefly lag behind a charge).
     """
-    if not current_user:
+    credits = await crud.async_credit.get_balance(db, user_id=current_user.id)
+    if credits is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return current_user 
\ No newline at end of file
+    return schemas.UserRead(**asdict(current_user), credits=credits)
@@ -0,0 +1,114 @@
+import asyncio
+import functools
+import zlib
+from typing import List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Bodies above this size are compressed in a worker thread (zlib and brotli
+# release the GIL), so multi-megabyte payloads do not stall the event loop.
+THREADED_COMPRESSION_SIZE = 256 * 1024
+# Bodies this large are almost always Base64 image data, where LZ77 finds nothing
+# to reuse: Huffman coding alone saves the same ~25% in a quarter of the time.
+HUFFMAN_ONLY_SIZE = 1024 * 1024
+
+
+@functools.lru_cache(maxsize=None)
+def _brotli():
+    """The optional `brotli` module, or None when it is not installed."""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Picks "br" or "gzip" from an Accept-Encoding header, preferring Brotli when available."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    for coding in ("br", "gzip"):
+        if coding == "br" and _brotli() is None:
+            continue
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Compresses JSON responses with Brotli or gzip, whichever the client accepts
+    (Brotli only when the optional `brotli` package is installed). Other media
+    types, such as images and event streams, pass through as is.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 5, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" not in headers and headers.get("content-type", "").startswith("application/json"):
+                    start = message  # Held back until the whole body is known
+                    return
+                await send(message)
+                return
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            # JSON bodies are complete documents, so collecting the chunks (an
+            # outer BaseHTTPMiddleware re-streams every body) costs no latency.
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            headers = MutableHeaders(raw=start["headers"])
+            if len(body) >= self.minimum_size:
+                if len(body) >= THREADED_COMPRESSION_SIZE:
+                    body = await asyncio.to_thread(self.compress, body, encoding)
+                else:
+                    body = self.compress(body, encoding)
+                headers["content-encoding"] = encoding
+                headers["content-length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return _brotli().compress(body, quality=self.brotli_quality)
+        strategy = zlib.Z_HUFFMAN_ONLY if len(body) >= HUFFMAN_ONLY_SIZE else zlib.Z_DEFAULT_STRATEGY
+        # wbits=31 writes the gzip container rather than a raw zlib stream.
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31, 8, strategy)
+        return compressor.compress(body) + compressor.flush()
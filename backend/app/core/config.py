@@ -1,6 +1,9 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
+import logging
 import os
-from typing import Optional, List, Union
+from typing import Dict, Optional, List, Union
+
+logger = logging.getLogger(__name__)
 
 class Config(BaseSettings):
     # Pydantic V2 configuration using model_config dictionary
@@ -18,6 +21,27 @@ class Config(BaseSettings):
 
     # Database settings - We will now read the full URL directly from the .env file
     DATABASE_URL: str
+    # Async driver URL; derived from DATABASE_URL (asyncpg / aiosqlite) when not set
+    ASYNC_DATABASE_URL: Optional[str] = None
+    # Optional read replica for read-only routes (e.g. /users/me); its async URL is derived the same way.
+    # Replicas may lag behind the primary, so only routes that tolerate slightly stale data use it.
+    DATABASE_READ_URL: Optional[str] = None
+    ASYNC_DATABASE_READ_URL: Optional[str] = None
+
+    # Connection pool, per engine (in-memory SQLite always uses a single connection)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0 # Seconds to wait for a free connection before failing
+    DB_POOL_RECYCLE: int = 1800 # Replace connections older than this many seconds; -1 disables
+    DB_POOL_PRE_PING: bool = True
+
+    # SQLite only: applied to every new connection
+    SQLITE_JOURNAL_MODE: str = "WAL" # Readers no longer block on a writer (and vice versa)
+    SQLITE_SYNCHRONOUS: str = "NORMAL" # Safe with WAL; fsyncs at checkpoints rather than every commit
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000 # Wait this long for a lock instead of failing with "database is locked"
+
+    # Prompt search ranks only this many of the newest matching images, keeping its cost flat as histories grow
+    PROMPT_SEARCH_MAX_CANDIDATES: int = 2000
 
     # Tencent Cloud API Credentials
     TENCENT_SECRET_ID: Optional[str] = None
@@ -28,9 +52,116 @@ class Config(BaseSettings):
 
     # Fireworks.ai API Key
     FIREWORKS_API_KEY: Optional[str] = None
+    # Workflow models are addressed as <base><account>/models/<model>/text_to_image;
+    # point this elsewhere for a stand-in upstream (see benchmarks/mock_upstream.py)
+    FIREWORKS_API_BASE_URL: str = "https://api.fireworks.ai/inference/v1/workflows/accounts/"
 
     # Cloudflare Turnstile
     CLOUDFLARE_TURNSTILE_SECRET_KEY: str = os.getenv("CLOUDFLARE_TURNSTILE_SECRET_KEY", "your_secret_key_here")
+    TURNSTILE_VERIFY_URL: str = "https://challenges.cloudflare.com/turnstile/v0/siteverify"
+
+    # Upstream HTTP client pools (shared for the lifetime of the app)
+    HTTP_CONNECT_TIMEOUT: float = 10.0
+    HTTP_POOL_TIMEOUT: float = 30.0 # Max wait for a free connection from the pool
+    HTTP_KEEPALIVE_EXPIRY: float = 60.0
+    FIREWORKS_READ_TIMEOUT: float = 180.0
+    FIREWORKS_MAX_CONNECTIONS: int = 64
+    FIREWORKS_MAX_KEEPALIVE_CONNECTIONS: int = 32
+    FIREWORKS_HTTP2: bool = True # Only used when the 'h2' package is installed
+    TURNSTILE_TIMEOUT: float = 10.0
+    TURNSTILE_MAX_CONNECTIONS: int = 20
+    TURNSTILE_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    TURNSTILE_HTTP2: bool = True
+    # Seconds a verified token is accepted again without asking Cloudflare, so a request rejected after
+    # verification (e.g. 402 for too few credits) can be retried with the same token; 0 disables.
+    # Cloudflare itself accepts a token for 300 seconds, but only once.
+    TURNSTILE_VERIFIED_CACHE_TTL: float = 300.0
+    TURNSTILE_VERIFIED_CACHE_MAX_ENTRIES: int = 10000
+
+    # Image generation job queue
+    # Max generation jobs running at once per process (including /generate/, which waits on a job).
+    # Defaults to UPSTREAM_CONCURRENCY_MAX, so the upstream limiter rather than the queue sets the pace.
+    JOB_WORKERS: Optional[int] = None
+    JOB_MAX_PENDING: int = 100 # Jobs waiting for a worker beyond this are rejected with 503
+    JOB_RESULT_TTL: float = 600.0 # Seconds a finished job's result is kept for polling
+
+    PASSWORD_HASH_WORKERS: int = 2 # Threads for bcrypt work, so it never runs on the event loop
+
+    # Per-process cache of user identities resolved from the X-User-Id header
+    IDENTITY_CACHE_TTL: float = 60.0 # Bounds how stale a subscription change made by another process can be
+    IDENTITY_CACHE_MAX_ENTRIES: int = 10000
+
+    # Credit ledger: reservations not settled within this time (e.g. after a worker crash) are refunded
+    CREDIT_RESERVATION_TIMEOUT: float = 900.0
+    CREDIT_SWEEP_INTERVAL: float = 60.0 # Seconds between sweeps for orphaned reservations; 0 disables it
+
+    # Generated image storage (content-addressed by SHA-256)
+    STORAGE_BACKEND: str = "filesystem"
+    STORAGE_DIR: str = "app/static/blobs"
+    BLOB_CACHE_MAX_AGE: int = 31536000 # Blobs never change, so they can be cached for a year
+    BLOB_BASE_URL: Optional[str] = None # e.g. a CDN in front of /images/blob; defaults to this API
+    IMAGE_RESPONSE_FORMAT: str = "url" # "url" or "b64_json" (legacy data URLs)
+
+    # Image post-processing (runs in a process pool)
+    IMAGE_PROCESS_WORKERS: int = 2
+    IMAGE_VARIANT_FORMATS: List[str] = ["webp", "avif"] # Encoded eagerly for every generated image
+    IMAGE_THUMBNAIL_SIZES: List[int] = [256, 512] # Longest side in pixels
+    IMAGE_WEBP_QUALITY: int = 80
+    IMAGE_AVIF_QUALITY: int = 60
+    IMAGE_JPEG_QUALITY: int = 85
+
+    # Image-to-image reference uploads (stored as blobs, deduplicated by content hash)
+    REFERENCE_IMAGE_MAX_BYTES: int = 10 * 1024 * 1024
+    REFERENCE_IMAGE_MAX_PIXELS: int = 40_000_000 # Rejects decompression bombs before they are decoded
+    REFERENCE_IMAGE_DEFAULT_STRENGTH: float = 0.35 # Used when a request sets no reference_strength
+    REFERENCE_UPLOAD_QUOTA: int = 30 # Uploads per client (user, or IP address when anonymous) per window; 0 disables it
+    REFERENCE_UPLOAD_QUOTA_WINDOW: float = 3600.0
+
+    # Prompt-level result cache (requests opt in with "cache": true)
+    GENERATION_CACHE_DEFAULT: bool = False
+    GENERATION_CACHE_MAX_ENTRIES: int = 2048
+    GENERATION_CACHE_MAX_BYTES: int = 256 * 1024 * 1024 # Only counts bytes held in memory
+    GENERATION_CACHE_TTL: float = 24 * 3600
+    GENERATION_CACHE_BLOB_BACKED: bool = True # Keep only blob keys in memory, images in the blob store
+    GENERATION_SINGLE_FLIGHT: bool = True # Coalesce concurrent identical generations
+
+    # Adaptive concurrency control per upstream model (AIMD on 429 responses)
+    UPSTREAM_CONCURRENCY_INITIAL: float = 16
+    UPSTREAM_CONCURRENCY_MIN: float = 1
+    UPSTREAM_CONCURRENCY_MAX: float = 64
+    UPSTREAM_BACKOFF_FACTOR: float = 0.5 # Limit multiplier applied on every 429
+    UPSTREAM_DEFAULT_RETRY_AFTER: float = 1.0 # Pause when a 429 has no Retry-After header
+    UPSTREAM_QUEUE_MAX_WAIT: float = 30.0 # Max seconds a call may queue before failing with 503
+
+    # Retries and hedged requests for upstream calls
+    UPSTREAM_MAX_ATTEMPTS: int = 3 # Including the first attempt
+    UPSTREAM_RETRY_BASE_DELAY: float = 0.5
+    UPSTREAM_RETRY_MAX_DELAY: float = 5.0
+    UPSTREAM_HEDGE_PERCENTILE: float = 95 # Hedge calls slower than this latency percentile; 0 disables
+    UPSTREAM_HEDGE_MIN_SAMPLES: int = 20 # No hedging until this many latencies have been observed
+    UPSTREAM_LATENCY_WINDOW: int = 200
+    UPSTREAM_EXTRA_CALLS_PER_IMAGE: int = 1 # Retry/hedge budget per requested image
+
+    # Logging (records are written by a background thread, see app/core/logs.py)
+    LOG_LEVEL: str = "INFO"
+    LOG_LEVELS: Dict[str, str] = { # Per-logger overrides
+        "httpx": "WARNING", "httpcore": "WARNING", "aiosqlite": "WARNING", "PIL": "INFO", "passlib": "INFO",
+    }
+    LOG_FORMAT: str = "json" # "json" or "text"
+    LOG_DEBUG_SAMPLE_RATE: float = 1.0 # Fraction of DEBUG records kept when DEBUG is enabled
+    LOG_MAX_FIELD_LENGTH: int = 512 # Longer strings are truncated
+    LOG_REDACT_FIELDS: List[str] = [
+        "authorization", "password", "secret", "token", "turnstile_token", "api_key", "image_b64",
+    ]
+
+    METRICS_ENABLED: bool = True # Serve Prometheus metrics at /metrics
+    METRICS_TOKEN: Optional[str] = None # Bearer token scrapers must send; /metrics is not served until it is set
+
+    # JSON response compression, negotiated from Accept-Encoding (Brotli needs the optional `brotli` package)
+    RESPONSE_COMPRESSION: bool = True
+    RESPONSE_COMPRESSION_MIN_SIZE: int = 1024 # Smaller bodies are not worth compressing
+    RESPONSE_GZIP_LEVEL: int = 5
+    RESPONSE_BROTLI_QUALITY: int = 4 # Brotli's fast levels still beat gzip -9 on JSON
 
     # Creem API Key
     CREEM_API_KEY: Optional[str] = None
@@ -41,11 +172,19 @@ class Config(BaseSettings):
     CLIENT_BASE_URL: str = "http://localhost:3000"
 
     NEXTAUTH_SECRET: Optional[str] = os.getenv("NEXTAUTH_SECRET")
+    JWT_CLAIMS_CACHE_TTL: float = 300.0 # Max seconds verified token claims are reused; never past the token's exp
+    JWT_CLAIMS_CACHE_MAX_ENTRIES: int = 10000
 
 settings = Config()
 
-if not settings.TTAPI_KEY or settings.TTAPI_KEY == "YOUR_TTAPI_KEY":
-    print("--- WARNING: TTAPI_KEY is not set or is using the default placeholder in the .env file.")
 
-if not settings.NEXTAUTH_SECRET:
-    print("--- WARNING: NEXTAUTH_SECRET is not set. This might affect other parts of the app if they exist.") 
\ No newline at end of file
+def check_settings() -> None:
+    """Logs warnings about missing secrets. Called at startup, once logging is configured."""
+    if not settings.TTAPI_KEY or settings.TTAPI_KEY == "YOUR_TTAPI_KEY":
+        logger.warning("TTAPI_KEY is not set or is using the default placeholder in the .env file.")
+
+    if not settings.NEXTAUTH_SECRET:
+        logger.warning("NEXTAUTH_SECRET is not set. This might affect other parts of the app if they exist.")
+
+    if settings.METRICS_ENABLED and not settings.METRICS_TOKEN:
+        logger.warning("METRICS_TOKEN is not set, so /metrics is not served. Set it and configure it as the scraper's bearer token.")
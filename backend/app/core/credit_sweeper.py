@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from typing import Optional
+
+import app.crud as crud
+from app.core.config import settings
+from app.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+_task: Optional[asyncio.Task] = None
+
+
+async def sweep_once() -> int:
+    """Refunds credit reservations that were never settled, e.g. because a worker crashed."""
+    async with AsyncSessionLocal() as db:
+        released = await crud.async_credit.release_orphaned(db, older_than=settings.CREDIT_RESERVATION_TIMEOUT)
+    if released:
+        logger.warning(f"Released {released} orphaned credit reservation(s).")
+    return released
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await sweep_once()
+        except Exception as e:
+            logger.error(f"Credit sweep failed: {type(e).__name__} - {e}")
+        await asyncio.sleep(settings.CREDIT_SWEEP_INTERVAL)
+
+
+async def start() -> None:
+    global _task
+    if _task is None and settings.CREDIT_SWEEP_INTERVAL > 0:
+        _task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
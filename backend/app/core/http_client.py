@@ -0,0 +1,105 @@
+import functools
+import logging
+import ssl
+from typing import Dict
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 is only available when the optional `h2` package is installed.
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+FIREWORKS = "fireworks"
+TURNSTILE = "turnstile"
+
+# Application-lifetime clients, one connection pool per upstream.
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _ssl_context() -> ssl.SSLContext:
+    # Loading the CA bundle takes tens of milliseconds; every client shares one context.
+    return httpx.create_ssl_context()
+
+
+def _build_client(name: str) -> httpx.AsyncClient:
+    """Creates the pooled client for a single upstream using the limits from `Config`."""
+    if name == FIREWORKS:
+        limits = httpx.Limits(
+            max_connections=settings.FIREWORKS_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.FIREWORKS_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(
+            settings.FIREWORKS_READ_TIMEOUT,
+            connect=settings.HTTP_CONNECT_TIMEOUT,
+            pool=settings.HTTP_POOL_TIMEOUT,
+        )
+        http2 = settings.FIREWORKS_HTTP2
+    elif name == TURNSTILE:
+        limits = httpx.Limits(
+            max_connections=settings.TURNSTILE_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.TURNSTILE_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(
+            settings.TURNSTILE_TIMEOUT,
+            connect=settings.HTTP_CONNECT_TIMEOUT,
+            pool=settings.HTTP_POOL_TIMEOUT,
+        )
+        http2 = settings.TURNSTILE_HTTP2
+    else:
+        raise ValueError(f"Unknown upstream: {name}")
+
+    if http2 and not HTTP2_AVAILABLE:
+        logger.warning(f"HTTP/2 requested for '{name}' but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+        http2 = False
+
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2, verify=_ssl_context())
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """
+    Returns the shared client for an upstream.
+    Clients are normally opened by `startup()` in the lifespan hook; if a client is
+    requested outside of it (scripts, tests) it is created lazily on first use.
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _build_client(name)
+        _clients[name] = client
+    return client
+
+
+def fireworks_client() -> httpx.AsyncClient:
+    return get_client(FIREWORKS)
+
+
+def turnstile_client() -> httpx.AsyncClient:
+    return get_client(TURNSTILE)
+
+
+async def startup() -> None:
+    """Opens the pooled clients for every upstream."""
+    for name in (FIREWORKS, TURNSTILE):
+        get_client(name)
+    logger.info(f"Upstream HTTP clients started: {', '.join(_clients)}")
+
+
+async def shutdown() -> None:
+    """Closes every pooled client, draining their keep-alive connections."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning(f"Error while closing upstream HTTP client: {e}")
+    logger.info("Upstream HTTP clients closed.")
@@ -0,0 +1,66 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.core import metrics
+from app.core.cache import CACHE_COUNTERS, LRUCache
+from app.core.config import settings
+from app.models.user import User
+
+
+@dataclass(frozen=True)
+class UserIdentity:
+    """
+    The fields of a user that identify and authorise them. Balances are deliberately
+    not included: they change on every generation and are always read from the
+    credit ledger instead.
+    """
+    id: str
+    email: str
+    is_active: bool
+    is_superuser: bool
+    is_verified: bool = False
+    creem_price_id: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserIdentity":
+        return cls(
+            id=user.id,
+            email=user.email,
+            is_active=user.is_active,
+            is_superuser=user.is_superuser,
+            is_verified=user.is_verified,
+            creem_price_id=user.creem_price_id,
+        )
+
+
+# Keyed by the X-User-Id header value, which may differ from the stored id for
+# users matched by email.
+identity_cache: LRUCache[str, UserIdentity] = LRUCache(
+    max_entries=settings.IDENTITY_CACHE_MAX_ENTRIES,
+    ttl=settings.IDENTITY_CACHE_TTL,
+)
+
+
+def get_identity(key: str) -> Optional[UserIdentity]:
+    return identity_cache.get(key)
+
+
+def remember(key: str, user: User) -> UserIdentity:
+    identity = UserIdentity.from_user(user)
+    identity_cache.set(key, identity)
+    return identity
+
+
+def invalidate(user_id: str) -> None:
+    """Drops a user's cached identity, under every key it was cached by."""
+    identity_cache.pop(user_id)
+    for key, identity in identity_cache.items():
+        if identity.id == user_id:
+            identity_cache.pop(key)
+
+
+def stats() -> Dict[str, int]:
+    return identity_cache.stats()
+
+
+metrics.stats_collector("identity_cache", "Identity cache size (entries).", stats, counters=CACHE_COUNTERS)
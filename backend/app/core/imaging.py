@@ -0,0 +1,231 @@
+import asyncio
+import functools
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.storage import blob_store
+
+logger = logging.getLogger(__name__)
+
+FORMAT_MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Keeps fire-and-forget variant tasks alive until they finish.
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def variant_name(fmt: str, size: Optional[int] = None) -> str:
+    """Names a variant by its longest side and format, e.g. "256.webp" or "full.avif"."""
+    return f"{size or 'full'}.{fmt}"
+
+
+@functools.lru_cache(maxsize=None)
+def supported_formats() -> Set[str]:
+    from PIL import features
+
+    formats = {"png", "jpeg"}
+    if features.check("webp"):
+        formats.add("webp")
+    if features.check("avif"):
+        formats.add("avif")
+    return formats
+
+
+def encoder_quality() -> Dict[str, int]:
+    # Passed explicitly to pool workers rather than read from settings inside them.
+    return {
+        "webp": settings.IMAGE_WEBP_QUALITY,
+        "avif": settings.IMAGE_AVIF_QUALITY,
+        "jpeg": settings.IMAGE_JPEG_QUALITY,
+    }
+
+
+def _encode(image, fmt: str, quality: Dict[str, int]) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        image.save(buffer, "WEBP", quality=quality["webp"], method=4)
+    elif fmt == "avif":
+        image.save(buffer, "AVIF", quality=quality["avif"])
+    elif fmt == "jpeg":
+        # Progressive JPEGs render a coarse preview before the full image has arrived.
+        image.convert("RGB").save(buffer, "JPEG", quality=quality["jpeg"], progressive=True, optimize=True)
+    else:
+        image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def _resize(image, size: Optional[int]):
+    if size is None or max(image.size) <= size:
+        return image
+    from PIL import Image
+
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return thumbnail
+
+
+def transcode(data: bytes, fmt: str, size: Optional[int], quality: Dict[str, int]) -> bytes:
+    """Re-encodes an image to `fmt`, downscaled so its longest side is at most `size`."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        return _encode(_resize(image, size), fmt, quality)
+
+
+def build_variants(data: bytes, formats: List[str], sizes: List[int], quality: Dict[str, int]) -> Dict[str, bytes]:
+    """
+    Produces every configured variant of an image in one call, decoding the source
+    once and resizing once per size. Runs inside the process pool.
+    """
+    from PIL import Image
+
+    variants = {}
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        for size in [None, *sizes]:
+            resized = _resize(image, size)
+            for fmt in formats:
+                variants[variant_name(fmt, size)] = _encode(resized, fmt, quality)
+    return variants
+
+
+def inspect_image(data: bytes, max_pixels: int) -> Tuple[int, int]:
+    """
+    Checks that `data` is a complete image of at most `max_pixels` and returns its
+    size. The size is read from the header, so oversized images are never decoded.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        if width * height > max_pixels:
+            raise ValueError(f"Image is too large ({width}x{height}).")
+        image.load()
+    return width, height
+
+
+def reference_variant_name(width: int, height: int) -> str:
+    return f"{width}x{height}.jpeg"
+
+
+def fit_reference(data: bytes, width: int, height: int, quality: Dict[str, int]) -> bytes:
+    """
+    Downscales and centre-crops an image-to-image reference to exactly `width` x
+    `height` and re-encodes it as JPEG. Runs inside the process pool.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        # Lets the JPEG decoder scale down while decoding; the side is the larger of
+        # the two so EXIF rotation can never leave the image smaller than the target.
+        side = max(width, height)
+        image.draft("RGB", (side, side))
+        upright = ImageOps.exif_transpose(image).convert("RGB")
+    fitted = ImageOps.fit(upright, (width, height), Image.Resampling.LANCZOS)
+    return _encode(fitted, "jpeg", quality)
+
+
+async def get_reference(key: str, width: int, height: int) -> Optional[bytes]:
+    """
+    Returns a stored reference image fitted to `width` x `height`, preparing it in
+    the process pool the first time each size is requested.
+    Returns None if the source blob does not exist.
+    """
+    name = reference_variant_name(width, height)
+    data = await blob_store.get(key, name)
+    if data is not None:
+        return data
+    source = await blob_store.get(key)
+    if source is None:
+        return None
+    data = await run_in_pool(fit_reference, source, width, height, encoder_quality())
+    await blob_store.put_variant(key, name, data)
+    return data
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_PROCESS_WORKERS)
+    return _executor
+
+
+async def run_in_pool(func, *args):
+    """Runs CPU-bound Pillow work in the process pool so it never blocks the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), func, *args)
+
+
+def eager_formats() -> List[str]:
+    available = supported_formats()
+    return [fmt for fmt in settings.IMAGE_VARIANT_FORMATS if fmt in available]
+
+
+async def create_variants(key: str, data: bytes) -> None:
+    """Transcodes a stored blob into every configured format and thumbnail size."""
+    formats = eager_formats()
+    sizes = settings.IMAGE_THUMBNAIL_SIZES
+    if not formats:
+        return
+    # Variants are written in order, so the last one marks a completed run
+    # (identical content may have been generated and processed before).
+    if await blob_store.exists(key, variant_name(formats[-1], sizes[-1] if sizes else None)):
+        return
+    try:
+        variants = await run_in_pool(build_variants, data, formats, sizes, encoder_quality())
+        for name, variant_data in variants.items():
+            await blob_store.put_variant(key, name, variant_data)
+    except Exception as e:
+        logger.error(f"Failed to create variants for blob {key}: {type(e).__name__} - {e}")
+
+
+def schedule_variants(key: str, data: bytes) -> None:
+    """Starts variant creation in the background without delaying the response."""
+    task = asyncio.create_task(create_variants(key, data))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def get_or_create_variant(key: str, fmt: str, size: Optional[int]) -> Optional[str]:
+    """
+    Returns the name of a stored variant, transcoding it on demand if the background
+    stage has not produced it (yet). Returns None if the source blob does not exist.
+    """
+    name = variant_name(fmt, size)
+    if await blob_store.exists(key, name):
+        return name
+    data = await blob_store.get(key)
+    if data is None:
+        return None
+    variant_data = await run_in_pool(transcode, data, fmt, size, encoder_quality())
+    await blob_store.put_variant(key, name, variant_data)
+    return name
+
+
+def negotiate_format(accept: Optional[str]) -> Optional[str]:
+    """Picks the most compact format the client advertises in its Accept header."""
+    if not accept:
+        return None
+    available = supported_formats()
+    for fmt in ("avif", "webp"):
+        if fmt in available and FORMAT_MEDIA_TYPES[fmt] in accept:
+            return fmt
+    return None
+
+
+async def shutdown() -> None:
+    global _executor
+    for task in list(_background_tasks):
+        task.cancel()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
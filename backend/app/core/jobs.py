@@ -0,0 +1,248 @@
+import asyncio
+import contextvars
+import enum
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_WAIT_SECONDS = metrics.Histogram("job_queue_wait_seconds", "Time jobs spend queued before a worker picks them up.")
+JOB_RUN_SECONDS = metrics.Histogram("job_run_seconds", "Time jobs spend running, by outcome.", ["status"])
+
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    owner_id: Optional[str] = None
+    status: JobStatus = JobStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+    error_status: Optional[int] = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+
+class JobQueueFull(Exception):
+    """Raised by `JobQueue.submit` when no more jobs can be accepted."""
+
+
+class JobBackend:
+    """
+    Storage interface for job state.
+    The in-memory backend is used by default; a shared store (e.g. Redis) can be
+    plugged in by implementing these three methods.
+    """
+
+    async def save(self, job: Job) -> None:
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        raise NotImplementedError
+
+    async def delete(self, job_id: str) -> None:
+        raise NotImplementedError
+
+
+class InMemoryJobBackend(JobBackend):
+    """Keeps jobs in a dict. Finished jobs are dropped `ttl` seconds after completion."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._jobs: Dict[str, Job] = {}
+
+    def _evict_expired(self) -> None:
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def save(self, job: Job) -> None:
+        self._evict_expired()
+        self._jobs[job.id] = job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        self._evict_expired()
+        return self._jobs.get(job_id)
+
+    async def delete(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+
+
+JobFunc = Callable[[], Awaitable[Any]]
+FailureHook = Callable[[Job], Awaitable[None]]
+
+
+@dataclass
+class _QueuedJob:
+    job: Job
+    func: JobFunc
+    on_failure: Optional[FailureHook] = None
+    # The submitter's context, so the job sees its context variables (e.g. the request id).
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+
+class JobQueue:
+    """
+    Bounded in-process worker pool.
+    Jobs run independently of the HTTP request that submitted them, so a client
+    disconnect never interrupts a job half-way. `on_failure` hooks run exactly once
+    for every job that does not succeed, including jobs dropped at shutdown.
+    """
+
+    def __init__(self, backend: JobBackend, workers: int, max_pending: int):
+        self.backend = backend
+        self.workers = workers
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._done_events: Dict[str, asyncio.Event] = {}
+        self.running = 0
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._worker_tasks)
+
+    async def start(self) -> None:
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(i), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"Job queue started with {self.workers} workers.")
+
+    async def stop(self) -> None:
+        if not self.is_running:
+            return
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+        # Jobs that never got picked up still need their failure hooks to run.
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            await self._fail(item, "The server shut down before the job could run.", 503)
+        logger.info("Job queue stopped.")
+
+    async def submit(
+        self,
+        func: JobFunc,
+        *,
+        owner_id: Optional[str] = None,
+        on_failure: Optional[FailureHook] = None,
+    ) -> Job:
+        """Registers a job and queues it. Raises `JobQueueFull` if the queue is at capacity."""
+        if not self.is_running:
+            await self.start()
+        job = Job(id=str(uuid.uuid4()), owner_id=owner_id)
+        try:
+            self._queue.put_nowait(_QueuedJob(job=job, func=func, on_failure=on_failure))
+        except asyncio.QueueFull:
+            raise JobQueueFull("Too many generation jobs are pending. Please try again shortly.")
+        self._done_events[job.id] = asyncio.Event()
+        await self.backend.save(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await self.backend.get(job_id)
+
+    async def wait(self, job_id: str) -> Optional[Job]:
+        """Waits until the job finishes. Cancelling the waiter does not cancel the job."""
+        event = self._done_events.get(job_id)
+        if event is not None:
+            await event.wait()
+        return await self.backend.get(job_id)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": self.pending, "running": self.running}
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            item = await self._queue.get()
+            try:
+                await item.context.run(asyncio.create_task, self._run(item))
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, item: _QueuedJob) -> None:
+        job = item.job
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        JOB_QUEUE_WAIT_SECONDS.observe(job.started_at - job.created_at)
+        await self.backend.save(job)
+        self.running += 1
+        try:
+            result = await item.func()
+        except asyncio.CancelledError:
+            await self._fail(item, "The job was cancelled.", 503)
+            raise
+        except Exception as e:
+            # HTTPException-like errors carry a status code and a client-facing detail.
+            status_code = getattr(e, "status_code", 500)
+            detail = getattr(e, "detail", None) or "An unexpected error occurred while running the job."
+            logger.error(f"Job {job.id} failed: {type(e).__name__} - {e}")
+            await self._fail(item, str(detail), status_code)
+        else:
+            job.status = JobStatus.SUCCEEDED
+            job.result = result
+            job.finished_at = time.time()
+            await self.backend.save(job)
+            self._mark_done(job.id)
+        finally:
+            self.running -= 1
+            JOB_RUN_SECONDS.observe(time.time() - job.started_at, status=job.status.value)
+
+    async def _fail(self, item: _QueuedJob, error: str, status_code: int) -> None:
+        job = item.job
+        job.status = JobStatus.FAILED
+        job.error = error
+        job.error_status = status_code
+        job.finished_at = time.time()
+        if item.on_failure is not None:
+            try:
+                await item.on_failure(job)
+            except Exception as e:
+                logger.error(f"Failure hook for job {job.id} raised: {type(e).__name__} - {e}")
+        await self.backend.save(job)
+        self._mark_done(job.id)
+
+    def _mark_done(self, job_id: str) -> None:
+        event = self._done_events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+
+job_queue = JobQueue(
+    backend=InMemoryJobBackend(ttl=settings.JOB_RESULT_TTL),
+    workers=settings.JOB_WORKERS or int(settings.UPSTREAM_CONCURRENCY_MAX),
+    max_pending=settings.JOB_MAX_PENDING,
+)
+
+metrics.stats_collector("job_queue", "Generation jobs waiting for and running on a worker.", job_queue.stats)
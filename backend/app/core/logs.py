@@ -0,0 +1,136 @@
+"""
+Logging pipeline. Records are filtered and enqueued by a `QueueHandler` on the
+calling thread, then formatted and written by a `QueueListener` thread, so a slow
+stdout never blocks the event loop. Fields passed via `extra=` are emitted as
+structured fields; large or sensitive values are truncated or redacted.
+"""
+import json
+import logging
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+# Set per request by the middleware in main.py; job workers inherit it from the submitter.
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "taskName"}
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[QueueHandler] = None
+
+
+def truncate(value: str, max_length: Optional[int] = None) -> str:
+    max_length = max_length or settings.LOG_MAX_FIELD_LENGTH
+    if len(value) <= max_length:
+        return value
+    return f"{value[:max_length]}...(+{len(value) - max_length} chars)"
+
+
+def sanitize(key: str, value: Any) -> Any:
+    """Redacts sensitive fields and truncates long strings, recursing into dicts and lists."""
+    if key.lower() in settings.LOG_REDACT_FIELDS:
+        return "[redacted]" if value else value
+    if isinstance(value, str):
+        return truncate(value)
+    if isinstance(value, dict):
+        return {k: sanitize(str(k), v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [sanitize(key, v) for v in value]
+    return value
+
+
+def extra_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {
+        key: sanitize(key, value)
+        for key, value in record.__dict__.items()
+        if key not in _RESERVED_ATTRS and not key.startswith("_")
+    }
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the current request id. Runs on the calling thread."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keeps only a random fraction of DEBUG records."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage(), max(settings.LOG_MAX_FIELD_LENGTH, 4096)),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        entry.update(extra_fields(record))
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = extra_fields(record)
+        if getattr(record, "request_id", None):
+            fields = {"request_id": record.request_id, **fields}
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def setup() -> None:
+    """Routes the root logger through the background writer. Safe to call more than once."""
+    global _listener, _handler
+    if _listener is not None:
+        return
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _handler = QueueHandler(log_queue)
+    _handler.addFilter(RequestContextFilter())
+    _handler.addFilter(DebugSamplingFilter(settings.LOG_DEBUG_SAMPLE_RATE))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in settings.LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown() -> None:
+    """Flushes queued records and stops the background writer."""
+    global _listener, _handler
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger().removeHandler(_handler)
+    _listener = None
+    _handler = None
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import httpx
+
+from app.core import metrics
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class UpstreamBusy(Exception):
+    """Raised when a call could not get a slot within the limiter's max wait."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header (delta-seconds or HTTP-date) into seconds from now."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limiter for one upstream backend with AIMD control:
+    every success raises the limit additively (about +1 per limit's worth of calls),
+    a 429 cuts it multiplicatively and pauses new calls for the Retry-After period.
+    The limit is cut at most once per congestion window: 429s from calls that started
+    before the last cut were sent under the old limit and are not counted again.
+    Callers queue for a slot for at most `max_wait` seconds in total, including
+    re-queueing after a 429, before giving up with `UpstreamBusy`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: float,
+        min_limit: float,
+        max_limit: float,
+        max_wait: float,
+        backoff_factor: float,
+        default_retry_after: float,
+    ):
+        self.name = name
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_wait = max_wait
+        self.backoff_factor = backoff_factor
+        self.default_retry_after = default_retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        self.blocked_until = 0.0
+        self.last_cut = float("-inf")
+        self.throttled = 0
+        self.timeouts = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    @property
+    def cond(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _has_capacity(self, now: float) -> bool:
+        return now >= self.blocked_until and self.in_flight < max(1, int(self.limit))
+
+    async def _acquire(self, deadline: float) -> float:
+        """Waits for a slot and returns the time it was granted."""
+        async with self.cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._has_capacity(now):
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise UpstreamBusy(f"Upstream '{self.name}' is busy. Please try again shortly.")
+                    # Wake up when the Retry-After pause ends even if nobody releases a slot.
+                    pause = self.blocked_until - now
+                    timeout = min(remaining, pause) if pause > 0 else remaining
+                    try:
+                        await asyncio.wait_for(self.cond.wait(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            return time.monotonic()
+
+    async def _release(self, started: float, throttled_for: Optional[float] = None) -> None:
+        async with self.cond:
+            self.in_flight -= 1
+            if throttled_for is None:
+                self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            else:
+                self.throttled += 1
+                now = time.monotonic()
+                if started >= self.last_cut:
+                    # First 429 of this window: back off once and pause new calls. Later
+                    # 429s from the same burst neither cut the limit nor extend the pause.
+                    self.last_cut = now
+                    self.limit = max(self.min_limit, self.limit * self.backoff_factor)
+                    self.blocked_until = max(self.blocked_until, now + throttled_for)
+                    logger.warning(
+                        f"Upstream '{self.name}' throttled us; limit is now {self.limit:.1f}, "
+                        f"pausing for {throttled_for:.1f}s."
+                    )
+            self.cond.notify_all()
+
+    async def run(self, func: Callable[[], Awaitable[T]]) -> T:
+        """Runs `func` within a slot, re-queueing it after 429 responses while time remains."""
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            started = await self._acquire(deadline)
+            try:
+                result = await func()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 429:
+                    await self._release(started)
+                    raise
+                retry_after = parse_retry_after(e.response.headers.get("Retry-After"))
+                pause = retry_after if retry_after is not None else self.default_retry_after
+                await self._release(started, throttled_for=pause)
+                if time.monotonic() + pause >= deadline:
+                    raise
+                continue
+            except BaseException:
+                await self._release(started)
+                raise
+            await self._release(started)
+            return result
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "throttled": self.throttled,
+            "timeouts": self.timeouts,
+        }
+
+
+class ClientQuota:
+    """
+    Fixed-window quota of `limit` actions per client key (e.g. a user id or an IP
+    address). Counts are kept per process, like the other in-memory caches.
+    """
+
+    def __init__(self, limit: int, window: float, max_clients: int = 10000):
+        self.limit = limit
+        self.window = window
+        # key -> (window_end, actions used in the window)
+        self._windows: LRUCache[str, Tuple[float, int]] = LRUCache(max_entries=max_clients)
+
+    def consume(self, key: str) -> Optional[float]:
+        """Counts one action for `key`. Returns None if it is allowed, else the seconds until the window resets."""
+        if self.limit <= 0:
+            return None
+        now = time.monotonic()
+        entry = self._windows.get(key)
+        window_end, used = entry if entry is not None and entry[0] > now else (now + self.window, 0)
+        if used >= self.limit:
+            return window_end - now
+        self._windows.set(key, (window_end, used + 1), ttl=window_end - now)
+        return None
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+
+def get_limiter(name: str) -> AdaptiveLimiter:
+    """Returns the limiter for an upstream backend (one per MODEL_MAP model path)."""
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = AdaptiveLimiter(
+            name,
+            initial_limit=settings.UPSTREAM_CONCURRENCY_INITIAL,
+            min_limit=settings.UPSTREAM_CONCURRENCY_MIN,
+            max_limit=settings.UPSTREAM_CONCURRENCY_MAX,
+            max_wait=settings.UPSTREAM_QUEUE_MAX_WAIT,
+            backoff_factor=settings.UPSTREAM_BACKOFF_FACTOR,
+            default_retry_after=settings.UPSTREAM_DEFAULT_RETRY_AFTER,
+        )
+        _limiters[name] = limiter
+    return limiter
+
+
+def limiter_stats() -> Dict[str, Dict[str, float]]:
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
+
+
+# Keys of `AdaptiveLimiter.stats()` that only ever grow; they are exported as counters.
+LIMITER_COUNTERS = ("throttled", "timeouts")
+
+
+@metrics.collector("upstream_limiter", "Adaptive concurrency limiter state per upstream model (limit, in_flight, queue_depth).")
+def _collect_limiter_stats():
+    return [
+        ({"model": name, "stat": key}, value)
+        for name, stats in limiter_stats().items()
+        for key, value in stats.items()
+        if key not in LIMITER_COUNTERS
+    ]
+
+
+@metrics.collector("upstream_limiter_throttled_total", "429 responses received per upstream model.", type="counter")
+def _collect_limiter_throttled():
+    return [({"model": name}, stats["throttled"]) for name, stats in limiter_stats().items()]
+
+
+@metrics.collector("upstream_limiter_timeouts_total", "Calls per upstream model that gave up waiting for a slot.", type="counter")
+def _collect_limiter_timeouts():
+    return [({"model": name}, stats["timeouts"]) for name, stats in limiter_stats().items()]
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import random
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {500, 502, 503, 504}
+
+
+class LatencyTracker:
+    """
+    Keeps a sliding window of recent successful call latencies for one upstream.
+    Callers record the upstream call alone, not time spent queueing for it, so the
+    hedge threshold does not grow with local congestion.
+    """
+
+    def __init__(self, window: int, min_samples: int):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """The p-th percentile of recent latencies, or None until enough samples exist."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100.0))
+        return ordered[index]
+
+
+class RetryBudget:
+    """
+    Extra upstream calls (retries and hedges) a single generation request may make,
+    so a struggling upstream is not hit with an unbounded amount of duplicate work.
+    """
+
+    def __init__(self, calls: int):
+        self.remaining = calls
+
+    def try_spend(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS_CODES
+    # Timeouts, connection resets and protocol errors
+    return isinstance(exc, httpx.TransportError)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    cap = min(settings.UPSTREAM_RETRY_MAX_DELAY, settings.UPSTREAM_RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+_trackers: Dict[str, LatencyTracker] = {}
+
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    tracker = _trackers.get(name)
+    if tracker is None:
+        tracker = LatencyTracker(settings.UPSTREAM_LATENCY_WINDOW, settings.UPSTREAM_HEDGE_MIN_SAMPLES)
+        _trackers[name] = tracker
+    return tracker
+
+
+async def _hedged(
+    func: Callable[[], Awaitable[T]],
+    tracker: LatencyTracker,
+    budget: RetryBudget,
+    can_hedge: Optional[Callable[[], bool]],
+) -> T:
+    """
+    Runs `func`; if it is still running after the upstream's hedge-percentile latency,
+    starts a duplicate and returns whichever succeeds first, cancelling the other.
+    No duplicate is sent while `can_hedge` returns False.
+    """
+    threshold = tracker.percentile(settings.UPSTREAM_HEDGE_PERCENTILE) if settings.UPSTREAM_HEDGE_PERCENTILE else None
+    primary = asyncio.ensure_future(func())
+    if threshold is None:
+        return await primary
+
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=threshold)
+        if done or (can_hedge is not None and not can_hedge()) or not budget.try_spend():
+            return await primary
+
+        logger.info(f"Upstream call exceeded {threshold:.2f}s, sending a hedged request.")
+        tasks.add(asyncio.ensure_future(func()))
+        first_error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                first_error = first_error or task.exception()
+        raise first_error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def call_with_resilience(
+    func: Callable[[], Awaitable[T]],
+    *,
+    tracker: LatencyTracker,
+    budget: RetryBudget,
+    can_hedge: Optional[Callable[[], bool]] = None,
+) -> T:
+    """
+    Calls `func` with hedging, retrying retryable failures with jittered backoff.
+    `func` records its own latency in `tracker`, timing only the upstream call.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await _hedged(func, tracker, budget, can_hedge)
+        except Exception as e:
+            attempt += 1
+            if not is_retryable(e) or attempt >= settings.UPSTREAM_MAX_ATTEMPTS or not budget.try_spend():
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"Retryable upstream error ({type(e).__name__}: {e}); retrying in {delay:.2f}s.")
+            await asyncio.sleep(delay)
@@ -0,0 +1,75 @@
+from typing import Any, List, Sequence
+
+import orjson
+from starlette.responses import JSONResponse
+
+
+class RawJSON:
+    """
+    A value that is already encoded JSON, kept as a sequence of byte strings.
+    `dumps` splices the parts into its output verbatim, so large values that need
+    no escaping (e.g. Base64 data URLs) are never re-scanned or re-encoded, and
+    are copied exactly once, into the final response body.
+    """
+
+    __slots__ = ("parts",)
+
+    def __init__(self, *parts: bytes):
+        self.parts: Sequence[bytes] = parts
+
+    @classmethod
+    def data_url(cls, media_type: str, encoded: bytes) -> "RawJSON":
+        """A JSON string holding a data URL, from already Base64-encoded `encoded`."""
+        return cls(f'"data:{media_type};base64,'.encode("ascii"), encoded, b'"')
+
+    def __len__(self) -> int:
+        return sum(len(part) for part in self.parts)
+
+
+def _contains_raw(value: Any) -> bool:
+    if isinstance(value, RawJSON):
+        return True
+    if isinstance(value, dict):
+        return any(_contains_raw(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_contains_raw(item) for item in value)
+    return False
+
+
+def _collect(value: Any, out: List[bytes]) -> None:
+    if isinstance(value, RawJSON):
+        out.extend(value.parts)
+    elif isinstance(value, dict) and _contains_raw(value):
+        out.append(b"{")
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                out.append(b",")
+            out.append(orjson.dumps(str(key)))
+            out.append(b":")
+            _collect(item, out)
+        out.append(b"}")
+    elif isinstance(value, (list, tuple)) and _contains_raw(value):
+        out.append(b"[")
+        for i, item in enumerate(value):
+            if i:
+                out.append(b",")
+            _collect(item, out)
+        out.append(b"]")
+    else:
+        out.append(orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS))
+
+
+def dumps(value: Any) -> bytes:
+    """Encodes `value` as compact UTF-8 JSON with orjson, splicing in `RawJSON` parts."""
+    if not _contains_raw(value):
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    parts: List[bytes] = []
+    _collect(value, parts)
+    return b"".join(parts)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded by orjson, with support for pre-encoded `RawJSON` values."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from typing import Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+BLOB_KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+# Derived encodings of a blob, e.g. "full.webp", "256.avif" or the "1344x768.jpeg"
+# image-to-image reference crop (see app.core.imaging)
+VARIANT_RE = re.compile(r"^(full|\d{1,4}|\d{1,4}x\d{1,4})\.(png|jpeg|webp|avif)$")
+
+
+def content_hash(data: bytes) -> str:
+    """Blobs are keyed by the SHA-256 of their content."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_valid_key(key: str) -> bool:
+    return bool(BLOB_KEY_RE.match(key))
+
+
+def is_valid_variant(variant: str) -> bool:
+    return bool(VARIANT_RE.match(variant))
+
+
+def sniff_content_type(data: bytes) -> str:
+    """Guesses an image MIME type from its magic bytes."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    return "application/octet-stream"
+
+
+class BlobStore:
+    """
+    Content-addressed storage interface.
+    Methods mirror object-store semantics (put / get / head) so an S3-compatible
+    backend can implement them directly. Variants (transcoded copies of a blob) are
+    stored next to it under `<key>/<variant>`.
+    """
+
+    async def put(self, data: bytes) -> str:
+        """Stores `data` and returns its key. Storing the same content twice is a no-op."""
+        raise NotImplementedError
+
+    async def put_variant(self, key: str, variant: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    async def get(self, key: str, variant: Optional[str] = None) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def exists(self, key: str, variant: Optional[str] = None) -> bool:
+        raise NotImplementedError
+
+    def local_path(self, key: str, variant: Optional[str] = None) -> Optional[str]:
+        """Path on local disk for backends that have one, so files can be served with sendfile."""
+        return None
+
+
+class FileSystemBlobStore(BlobStore):
+    """Stores blobs under `root`, fanned out as `ab/cd/<hash>` to keep directories small."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str, variant: Optional[str] = None) -> str:
+        if not is_valid_key(key):
+            raise ValueError(f"Invalid blob key: {key}")
+        path = os.path.join(self.root, key[:2], key[2:4], key)
+        if variant is None:
+            return path
+        if not is_valid_variant(variant):
+            raise ValueError(f"Invalid blob variant: {variant}")
+        return f"{path}.variants{os.sep}{variant}"
+
+    def _write(self, key: str, data: bytes, variant: Optional[str] = None) -> None:
+        path = self._path(key, variant)
+        if os.path.exists(path):
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial blob.
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _read(self, key: str, variant: Optional[str] = None) -> Optional[bytes]:
+        try:
+            with open(self._path(key, variant), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def put(self, data: bytes) -> str:
+        key = content_hash(data)
+        await asyncio.to_thread(self._write, key, data)
+        return key
+
+    async def put_variant(self, key: str, variant: str, data: bytes) -> None:
+        await asyncio.to_thread(self._write, key, data, variant)
+
+    async def get(self, key: str, variant: Optional[str] = None) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, key, variant)
+
+    async def exists(self, key: str, variant: Optional[str] = None) -> bool:
+        return await asyncio.to_thread(os.path.exists, self._path(key, variant))
+
+    def local_path(self, key: str, variant: Optional[str] = None) -> Optional[str]:
+        path = self._path(key, variant)
+        return path if os.path.exists(path) else None
+
+
+def create_blob_store() -> BlobStore:
+    if settings.STORAGE_BACKEND == "filesystem":
+        return FileSystemBlobStore(settings.STORAGE_DIR)
+    raise ValueError(f"Unsupported STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+
+
+blob_store = create_blob_store()
@@ -1,2 +1,3 @@
-from .user import user
-from .image import image 
\ No newline at end of file
+from .user import user, async_user
+from .image import image, async_image
+from .credit import credit, async_credit
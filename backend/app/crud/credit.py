@@ -0,0 +1,150 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy import exists, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+
+from app.models.credit_transaction import CreditTransaction
+from app.models.user import User
+
+RESERVE = "reserve"
+COMMIT = "commit"
+REFUND = "refund"
+GRANT = "grant"
+
+
+def new_reference() -> str:
+    return uuid.uuid4().hex
+
+
+class CRUDCredit:
+    """
+    Credit ledger operations. Balance changes are single SQL statements on `users`
+    written in the same transaction as their `credit_transactions` row, so concurrent
+    requests never lose updates and the ledger always explains the balance.
+    """
+
+    def grant(self, db: Session, *, user_id: str, amount: int, reference: Optional[str] = None) -> Optional[int]:
+        """
+        Adds credits to a user. Returns the new balance, or None if the user does not exist.
+        """
+        new_credits = db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(credits=User.credits + amount)
+            .returning(User.credits)
+        ).scalar_one_or_none()
+        if new_credits is None:
+            db.rollback()
+            return None
+        db.add(CreditTransaction(user_id=user_id, kind=GRANT, amount=amount, reference=reference or new_reference()))
+        db.commit()
+        return new_credits
+
+
+class AsyncCRUDCredit:
+    """Async counterpart of `CRUDCredit`, with the reserve/settle flow used by generations."""
+
+    async def get_balance(self, db: AsyncSession, *, user_id: str) -> Optional[int]:
+        return (await db.execute(select(User.credits).where(User.id == user_id))).scalar_one_or_none()
+
+    async def reserve(self, db: AsyncSession, *, user_id: str, amount: int, reference: str) -> Optional[int]:
+        """
+        Takes `amount` credits from a user if, and only if, the balance covers it.
+        Returns the new balance, or None if the user has too few credits.
+        """
+        new_credits = (await db.execute(
+            update(User)
+            .where(User.id == user_id, User.credits >= amount)
+            .values(credits=User.credits - amount, credits_spent=User.credits_spent + amount)
+            .returning(User.credits)
+        )).scalar_one_or_none()
+        if new_credits is None:
+            await db.rollback()
+            return None
+        db.add(CreditTransaction(user_id=user_id, kind=RESERVE, amount=amount, reference=reference))
+        await db.commit()
+        return new_credits
+
+    async def settle(self, db: AsyncSession, *, user_id: str, reference: str, amount: int, refund: int = 0) -> bool:
+        """
+        Settles a reservation: keeps `amount - refund` credits and returns `refund` to the user.
+        A reservation settles exactly once (enforced by the ledger's unique constraint);
+        returns False if it had already been settled.
+        """
+        refund = max(0, min(refund, amount))
+        db.add(CreditTransaction(user_id=user_id, kind=COMMIT, amount=amount - refund, reference=reference))
+        if refund:
+            db.add(CreditTransaction(user_id=user_id, kind=REFUND, amount=refund, reference=reference))
+        try:
+            # Claim the settlement before touching the balance.
+            await db.flush()
+        except IntegrityError:
+            await db.rollback()
+            return False
+        if refund:
+            await db.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(credits=User.credits + refund, credits_spent=User.credits_spent - refund)
+            )
+        await db.commit()
+        return True
+
+    async def grant(self, db: AsyncSession, *, user_id: str, amount: int, reference: Optional[str] = None) -> Optional[int]:
+        """
+        Adds credits to a user. Returns the new balance, or None if the user does not exist.
+        """
+        new_credits = (await db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(credits=User.credits + amount)
+            .returning(User.credits)
+        )).scalar_one_or_none()
+        if new_credits is None:
+            await db.rollback()
+            return None
+        db.add(CreditTransaction(user_id=user_id, kind=GRANT, amount=amount, reference=reference or new_reference()))
+        await db.commit()
+        return new_credits
+
+    async def get_orphaned_reservations(
+        self, db: AsyncSession, *, older_than: float, limit: int = 100
+    ) -> List[CreditTransaction]:
+        """Reservations older than `older_than` seconds that were never settled."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than)
+        settled = aliased(CreditTransaction)
+        result = await db.execute(
+            select(CreditTransaction)
+            .where(
+                CreditTransaction.kind == RESERVE,
+                CreditTransaction.created_at < cutoff,
+                ~exists().where(settled.reference == CreditTransaction.reference, settled.kind == COMMIT),
+            )
+            .order_by(CreditTransaction.id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def release_orphaned(self, db: AsyncSession, *, older_than: float, limit: int = 100) -> int:
+        """
+        Refunds reservations left unsettled for longer than `older_than` seconds,
+        e.g. by a worker that crashed mid-generation. Returns how many were released.
+        """
+        # Copy the fields out first: a failed settlement rolls back and expires the rows.
+        orphans = [
+            (r.user_id, r.reference, r.amount)
+            for r in await self.get_orphaned_reservations(db, older_than=older_than, limit=limit)
+        ]
+        released = 0
+        for user_id, reference, amount in orphans:
+            if await self.settle(db, user_id=user_id, reference=reference, amount=amount, refund=amount):
+                released += 1
+        return released
+
+
+credit = CRUDCredit()
+async_credit = AsyncCRUDCredit()
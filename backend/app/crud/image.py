@@ -1,20 +1,62 @@
+import re
+
+from sqlalchemy import Row, and_, insert, literal, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
-from .base import CRUDBase
+from .base import AsyncCRUDBase, CRUDBase
+from app.core.config import settings
+from app.migrations import PROMPT_SEARCH_CONFIG, PROMPT_TSVECTOR
 from app.models.image import Image
 from app.schemas import ImageCreate
 
+MAX_SEARCH_TERMS = 8
+
+def search_terms(query: str) -> List[str]:
+    """
+    Splits a user's search into words. Only word characters survive, so the terms
+    are safe to place in an FTS5 or tsquery expression.
+    """
+    return re.findall(r"\w+", query.lower())[:MAX_SEARCH_TERMS]
+
+# Every term must match; the last one also as a prefix, for search-as-you-type.
+# Only the newest `candidates` matches are ranked, so the cost of a search is
+# bounded however many of the owner's prompts match.
+_POSTGRES_SEARCH = text(f"""
+    SELECT id, prompt, image_url, ts_rank_cd({PROMPT_TSVECTOR}, query) AS score
+    FROM (
+        SELECT id, prompt, image_url FROM images
+        WHERE owner_id = :owner_id AND {PROMPT_TSVECTOR} @@ to_tsquery('{PROMPT_SEARCH_CONFIG}', :query)
+        ORDER BY id DESC
+        LIMIT :candidates
+    ) AS hits, to_tsquery('{PROMPT_SEARCH_CONFIG}', :query) AS query
+    ORDER BY score DESC, id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+# bm25 is lower-is-better; owner_id gets weight 0 so it filters without affecting the rank.
+# FTS5 walks matches in rowid order and stops at the LIMIT, so only the newest
+# `candidates` matches are read and ranked.
+_SQLITE_SEARCH = text("""
+    SELECT images.id, images.prompt, images.image_url, hits.score
+    FROM (
+        SELECT rowid, -bm25(images_fts, 1.0, 0.0) AS score FROM images_fts
+        WHERE images_fts MATCH :query
+        ORDER BY rowid DESC
+        LIMIT :candidates
+    ) AS hits JOIN images ON images.id = hits.rowid
+    WHERE images.owner_id = :owner_id
+    ORDER BY hits.score DESC, images.id DESC
+    LIMIT :limit OFFSET :offset
+""")
+
 class CRUDImage(CRUDBase[Image, ImageCreate, ImageCreate]):
     def create_with_owner(
-        self, db: Session, *, obj_in: ImageCreate, owner_id: int, image_url: str
+        self, db: Session, *, obj_in: ImageCreate, owner_id: str, image_url: str
     ) -> Image:
         db_obj = Image(
             prompt=obj_in.prompt,
-            style=obj_in.style,
-            color=obj_in.color,
-            lighting=obj_in.lighting,
-            composition=obj_in.composition,
             owner_id=owner_id,
             image_url=image_url
         )
@@ -24,15 +66,94 @@ class CRUDImage(CRUDBase[Image, ImageCreate, ImageCreate]):
         return db_obj
 
     def get_multi_by_owner(
-        self, db: Session, *, owner_id: int, skip: int = 0, limit: int = 100
+        self, db: Session, *, owner_id: str, skip: int = 0, limit: int = 100, before_id: Optional[int] = None
     ) -> List[Image]:
-        return (
-            db.query(self.model)
-            .filter(Image.owner_id == owner_id)
-            .order_by(Image.id.desc())
-            .offset(skip)
-            .limit(limit)
-            .all()
+        """Newest first. Pass the last id seen as `before_id` to page by keyset instead of `skip`."""
+        query = db.query(self.model).filter(Image.owner_id == owner_id)
+        if before_id is not None:
+            query = query.filter(Image.id < before_id)
+        return query.order_by(Image.id.desc()).offset(skip).limit(limit).all()
+
+class AsyncCRUDImage(AsyncCRUDBase[Image, ImageCreate, ImageCreate]):
+    async def create_with_owner(
+        self, db: AsyncSession, *, obj_in: ImageCreate, owner_id: str, image_url: str
+    ) -> Image:
+        db_obj = Image(
+            prompt=obj_in.prompt,
+            owner_id=owner_id,
+            image_url=image_url
         )
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def create_many_with_owner(
+        self, db: AsyncSession, *, obj_in: ImageCreate, owner_id: str, image_urls: List[str]
+    ) -> None:
+        """Adds one history row per image in a single multi-row insert and commit; nothing is read back."""
+        if not image_urls:
+            return
+        rows = [{"prompt": obj_in.prompt, "owner_id": owner_id, "image_url": image_url} for image_url in image_urls]
+        await db.execute(insert(Image), rows)
+        await db.commit()
+
+    async def get_multi_by_owner(
+        self, db: AsyncSession, *, owner_id: str, skip: int = 0, limit: int = 100, before_id: Optional[int] = None
+    ) -> List[Image]:
+        """Newest first. Pass the last id seen as `before_id` to page by keyset instead of `skip`."""
+        query = select(Image).where(Image.owner_id == owner_id)
+        if before_id is not None:
+            query = query.where(Image.id < before_id)
+        result = await db.execute(query.order_by(Image.id.desc()).offset(skip).limit(limit))
+        return list(result.scalars().all())
+
+    async def get_history(
+        self, db: AsyncSession, *, owner_id: str, limit: int = 20, before_id: Optional[int] = None
+    ) -> List[Row]:
+        """
+        One page of an owner's history, newest first, as (id, prompt, image_url) rows.
+        Selects just those columns rather than loading Image objects, and seeks by
+        id on the (owner_id, id) index, so deep pages cost the same as the first.
+        """
+        query = select(Image.id, Image.prompt, Image.image_url).where(Image.owner_id == owner_id)
+        if before_id is not None:
+            query = query.where(Image.id < before_id)
+        result = await db.execute(query.order_by(Image.id.desc()).limit(limit))
+        return list(result.all())
+
+    async def search(
+        self, db: AsyncSession, *, owner_id: str, query: str, limit: int = 20, offset: int = 0
+    ) -> List[Row]:
+        """
+        Searches an owner's prompts, best match first, as (id, prompt, image_url, score)
+        rows. Uses the full-text index created by the images_prompt_search migration
+        (Postgres tsvector/GIN, SQLite FTS5) and ranks the newest
+        PROMPT_SEARCH_MAX_CANDIDATES matches; other databases fall back to
+        unindexed substring matching, newest first, with a score of 0.
+        """
+        terms = search_terms(query)
+        if not terms:
+            return []
+        params = {"owner_id": owner_id, "limit": limit, "offset": offset, "candidates": settings.PROMPT_SEARCH_MAX_CANDIDATES}
+        dialect = db.get_bind().dialect.name
+        if dialect == "postgresql":
+            expression = " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+            result = await db.execute(_POSTGRES_SEARCH, {**params, "query": expression})
+        elif dialect == "sqlite":
+            words = " ".join(f'"{term}"' for term in terms[:-1])
+            owner = '"' + owner_id.replace('"', '""') + '"'
+            expression = f'owner_id : {owner} AND prompt : ({words} "{terms[-1]}"*)'
+            result = await db.execute(_SQLITE_SEARCH, {**params, "query": expression})
+        else:
+            result = await db.execute(
+                select(Image.id, Image.prompt, Image.image_url, literal(0.0).label("score"))
+                .where(Image.owner_id == owner_id, and_(*(Image.prompt.ilike(f"%{term}%") for term in terms)))
+                .order_by(Image.id.desc())
+                .offset(offset)
+                .limit(limit)
+            )
+        return list(result.all())
 
-image = CRUDImage(Image) 
\ No newline at end of file
+image = CRUDImage(Image)
+async_image = AsyncCRUDImage(Image) 
\ No newline at end of file
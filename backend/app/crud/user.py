@@ -1,11 +1,22 @@
 from typing import Any, Dict, Optional, Union
 
+from sqlalchemy import insert as sa_insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.crud.base import CRUDBase
+from app.crud.base import AsyncCRUDBase, CRUDBase
+from app.crud.credit import async_credit, credit
 from app.models.user import User
 from app.schemas import UserCreate, UserUpdate
-from app.core.security import get_password_hash, verify_password
+from app.core import identity
+from app.core.security import (
+    UNUSABLE_PASSWORD,
+    get_password_hash,
+    get_password_hash_async,
+    verify_password,
+    verify_password_async,
+)
 
 
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
@@ -26,13 +37,13 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         
     def create_with_id(self, db: Session, *, obj_in: UserCreate) -> User:
         """
-        Creates a user with a specific string ID, with a hashed placeholder password.
-        Used for users created via NextAuth social logins.
+        Creates a user with a specific string ID and an unusable password.
+        Used for users created via NextAuth social logins, who never sign in with a password.
         """
         db_obj = User(
             id=obj_in.id,
             email=obj_in.email,
-            hashed_password=get_password_hash(obj_in.password),  # Hash the placeholder password
+            hashed_password=UNUSABLE_PASSWORD,
             credits=obj_in.credits,
             is_superuser=False # Default value
         )
@@ -54,6 +65,7 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
             del update_data["password"]
             update_data["hashed_password"] = hashed_password
 
+        identity.invalidate(db_obj.id)
         return super().update(db, db_obj=db_obj, obj_in=update_data)
 
     def authenticate(
@@ -80,14 +92,102 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
 
     def add_credits(self, db: Session, *, user_id: str, amount: int) -> Optional[User]:
         """
-        Adds credits to a user's account using their string ID.
+        Adds credits to a user's account using their string ID, recorded on the credit ledger.
         """
-        user = self.get_by_id_str(db, id=user_id)
-        if user:
-            user.credits = (user.credits or 0) + amount
-            db.commit()
-            db.refresh(user)
+        if credit.grant(db, user_id=user_id, amount=amount) is None:
+            return None
+        identity.invalidate(user_id)
+        return self.get_by_id_str(db, id=user_id)
+
+
+class AsyncCRUDUser(AsyncCRUDBase[User, UserCreate, UserUpdate]):
+    """Async counterpart of `CRUDUser`, used by request handlers."""
+
+    async def get_by_email(self, db: AsyncSession, *, email: str) -> Optional[User]:
+        result = await db.execute(select(User).where(User.email == email))
+        return result.scalars().first()
+
+    async def get_by_id_str(self, db: AsyncSession, *, id: str) -> Optional[User]:
+        """
+        Retrieves a user by their string ID.
+        """
+        return await db.get(User, id)
+
+    async def create_with_id(self, db: AsyncSession, *, obj_in: UserCreate) -> User:
+        """
+        Creates a user with a specific string ID and an unusable password.
+        Used for users created via NextAuth social logins, who never sign in with a password.
+        """
+        db_obj = User(
+            id=obj_in.id,
+            email=obj_in.email,
+            hashed_password=UNUSABLE_PASSWORD,
+            credits=obj_in.credits,
+            is_superuser=False # Default value
+        )
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def upsert_external(self, db: AsyncSession, *, id: str, email: str) -> Optional[User]:
+        """
+        Provisions a user authenticated by NextAuth, safely under concurrent first requests:
+        the insert is skipped if the id or email already exists, and whichever user
+        ended up stored is returned (looked up by id, then by email).
+        """
+        values = dict(id=id, email=email, hashed_password=UNUSABLE_PASSWORD, is_superuser=False)
+        dialect = db.bind.dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            await db.execute(insert(User).values(**values).on_conflict_do_nothing())
+            await db.commit()
+        else:
+            try:
+                await db.execute(sa_insert(User).values(**values))
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+        return await self.get_by_id_str(db, id=id) or await self.get_by_email(db, email=email)
+
+    async def update(
+        self, db: AsyncSession, *, db_obj: User, obj_in: Union[UserUpdate, Dict[str, Any]]
+    ) -> User:
+        if isinstance(obj_in, dict):
+            update_data = obj_in
+        else:
+            update_data = obj_in.model_dump(exclude_unset=True)
+
+        if update_data.get("password"):
+            hashed_password = await get_password_hash_async(update_data["password"])
+            del update_data["password"]
+            update_data["hashed_password"] = hashed_password
+
+        identity.invalidate(db_obj.id)
+        return await super().update(db, db_obj=db_obj, obj_in=update_data)
+
+    async def authenticate(
+        self, db: AsyncSession, *, email: str, password: str
+    ) -> Optional[User]:
+        user = await self.get_by_email(db, email=email)
+        if not user:
+            return None
+        if not await verify_password_async(password, user.hashed_password):
+            return None
         return user
 
+    async def add_credits(self, db: AsyncSession, *, user_id: str, amount: int) -> Optional[User]:
+        """
+        Adds credits to a user's account using their string ID, recorded on the credit ledger.
+        """
+        if await async_credit.grant(db, user_id=user_id, amount=amount) is None:
+            return None
+        identity.invalidate(user_id)
+        return await db.get(User, user_id, populate_existing=True)
+
 
-user = CRUDUser(User) 
\ No newline at end of file
+user = CRUDUser(User)
+async_user = AsyncCRUDUser(User) 
\ No newline at end of file
@@ -1,22 +1,231 @@
-from sqlalchemy import create_engine
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import QueuePool
+from app.core import metrics
 from app.core.config import settings
 
-# Create SQLAlchemy engine with DB-specific connect args.
-# Use SQLite-friendly args when DATABASE_URL starts with "sqlite".
-if settings.DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        settings.DATABASE_URL,
-        pool_pre_ping=True,
-        connect_args={"check_same_thread": False},
-    )
-else:
-    engine = create_engine(
-        settings.DATABASE_URL,
-        pool_pre_ping=True,
-        connect_args={"client_encoding": "utf8"},
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_async_read_engine: Optional[AsyncEngine] = None
+
+# Bound to their engines when those are first created, so importing this module
+# never loads a DB driver or opens a pool.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+# expire_on_commit=False: attributes stay readable after commit without an implicit (sync) reload.
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+# Sessions for read-only routes: the replica when DATABASE_READ_URL is set, else the primary.
+AsyncReadSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+
+def to_async_url(database_url: str) -> str:
+    """The async driver URL for a database URL: asyncpg for Postgres, aiosqlite for SQLite."""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    elif backend == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+    return url.render_as_string(hide_password=False)
+
+
+def get_async_database_url() -> str:
+    """
+    The async driver URL for DATABASE_URL: asyncpg for Postgres, aiosqlite for SQLite.
+    ASYNC_DATABASE_URL overrides it when set.
+    """
+    return settings.ASYNC_DATABASE_URL or to_async_url(settings.DATABASE_URL)
+
+
+def get_async_read_database_url() -> Optional[str]:
+    """The async URL of the read replica, or None when no replica is configured."""
+    if settings.ASYNC_DATABASE_READ_URL:
+        return settings.ASYNC_DATABASE_READ_URL
+    if settings.DATABASE_READ_URL:
+        return to_async_url(settings.DATABASE_READ_URL)
+    return None
+
+
+def is_sqlite(database_url: str) -> bool:
+    return make_url(database_url).get_backend_name() == "sqlite"
+
+
+def pool_options(database_url: str) -> dict:
+    """Pool arguments from `Config` for an engine on `database_url`."""
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING}
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options  # In-memory SQLite uses a single static connection; there is no pool to size
+    options.update(
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
     )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    finally:
+        cursor.close()
+
+
+def get_engine() -> Engine:
+    """The sync engine, for scripts such as init_db.py. Created on first use."""
+    global _engine
+    if _engine is None:
+        # DB-specific connect args: SQLite-friendly when DATABASE_URL starts with "sqlite".
+        if is_sqlite(settings.DATABASE_URL):
+            connect_args = {"check_same_thread": False}
+        else:
+            connect_args = {"client_encoding": "utf8"}
+        _engine = create_engine(settings.DATABASE_URL, connect_args=connect_args, **pool_options(settings.DATABASE_URL))
+        _instrument(_engine, settings.DATABASE_URL)
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def _create_async_engine(database_url: str) -> AsyncEngine:
+    if is_sqlite(database_url):
+        connect_args = {}
+    else:
+        connect_args = {"server_settings": {"client_encoding": "utf8"}}
+    engine = create_async_engine(database_url, connect_args=connect_args, **pool_options(database_url))
+    _instrument(engine.sync_engine, database_url)
+    return engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """The async engine for request handlers, so DB round trips don't block the event loop."""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = _create_async_engine(get_async_database_url())
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
+
+
+def get_async_read_engine() -> AsyncEngine:
+    """The engine for read-only routes: the replica if one is configured, else the primary."""
+    global _async_read_engine
+    if _async_read_engine is None:
+        read_url = get_async_read_database_url()
+        _async_read_engine = _create_async_engine(read_url) if read_url else get_async_engine()
+        AsyncReadSessionLocal.configure(bind=_async_read_engine)
+    return _async_read_engine
+
+
+def __getattr__(name: str):
+    # `from app.database import engine` keeps working for scripts, creating the engine then.
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+async def startup() -> None:
+    """Creates the async engines. No connection is opened until the first query."""
+    get_async_engine()
+    get_async_read_engine()
+
+
+async def shutdown() -> None:
+    global _engine, _async_engine, _async_read_engine
+    if _async_read_engine is not None and _async_read_engine is not _async_engine:
+        await _async_read_engine.dispose()
+    _async_read_engine = None
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+def create_tables() -> None:
+    """
+    Creates any missing tables and applies the migrations in app/migrations.py
+    (indexes, search tables). This is an explicit setup step (see init_db.py);
+    the application itself never touches the schema on import or startup.
+    """
+    import app.models  # noqa: F401  Registers every model on Base.metadata
+    from app.migrations import run_migrations
+
+    Base.metadata.create_all(bind=get_engine())
+    run_migrations(get_engine())
+
+
+# --- Query timings, recorded for both engines through SQLAlchemy cursor events ---
+DB_QUERY_SECONDS = metrics.Histogram(
+    "db_query_seconds",
+    "Time spent executing SQL statements, by statement type.",
+    ["operation"],
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start_time"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+    DB_QUERY_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+
+def _handle_error(exception_context):
+    # Failed statements never reach after_cursor_execute; drop their start time.
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+def _instrument(engine: Engine, database_url: str) -> None:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    if is_sqlite(database_url):
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """Connection pool usage per engine that has been created and has a sized pool."""
+    engines = {"sync": _engine, "async": _async_engine}
+    if _async_read_engine is not _async_engine:
+        engines["async_read"] = _async_read_engine
+    stats = {}
+    for name, engine in engines.items():
+        if engine is None:
+            continue
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            stats[name] = {
+                "size": pool.size(),
+                "max_overflow": settings.DB_MAX_OVERFLOW,
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                # SQLAlchemy reports overflow as checked_out - size, negative until the pool is full.
+                "overflow": max(0, pool.overflow()),
+            }
+    return stats
+
+
+@metrics.collector("db_pool", "Connection pool state per engine (size, max_overflow, checked_out, checked_in, overflow).")
+def _collect_pool_stats():
+    return [
+        ({"engine": name, "stat": key}, value)
+        for name, stats in pool_stats().items()
+        for key, value in stats.items()
+    ]
 
 class Base(DeclarativeBase):
     pass
@@ -26,4 +235,13 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db() -> AsyncIterator[AsyncSession]:
+    """Session for read-only routes, served by the read replica when one is configured."""
+    async with AsyncReadSessionLocal() as db:
+        yield db
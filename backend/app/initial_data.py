@@ -1,6 +1,6 @@
 import logging
 from sqlalchemy.orm import Session
-from app.database import SessionLocal, engine
+from app.database import SessionLocal, create_tables
 from app.models import (
     User,
     Plan,
@@ -10,7 +10,6 @@ from app.models import (
     Comment,
     Favorite,
 )
-from app.database import Base
 from app.schemas import PlanCreate
 from app.crud import create_plan
 
@@ -21,7 +20,7 @@ def init_db(db: Session) -> None:
     # Tables should be created with Alembic migrations
     # But for development and quick starts, this is fine
     logger.info("Creating all tables in database...")
-    Base.metadata.create_all(bind=engine)
+    create_tables()
     logger.info("Tables created successfully.")
 
     # Check if plans already exist
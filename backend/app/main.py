@@ -1,8 +1,11 @@
 import sys
 import os
+import re
+import secrets
 import time
+import uuid
 import logging
-from logging.config import dictConfig
+from contextlib import asynccontextmanager
 
 # Add the project root directory to the Python path
 # This ensures that all modules can be imported correctly, regardless of how the app is run.
@@ -11,26 +14,61 @@ project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from fastapi import FastAPI, Request
+from typing import Optional
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-# Configure logging
-# This ensures that logs are always displayed, even in production environments
-# Remove the complex dictConfig and rely on basicConfig or print
-# logging.basicConfig(level=logging.INFO)
+# Configure logging: see app/core/logs.py. The pipeline is started in `lifespan`.
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_RE = re.compile(r"[A-Za-z0-9._-]{1,64}")
 
 # Correctly import settings from the core config file
 from app.core.config import settings
 from .api.api_v1.api import api_router as api_v1_router
-from app.database import Base, engine
-
-# Create all tables
-Base.metadata.create_all(bind=engine)
+from app import database
+from app.core import config, credit_sweeper, http_client, imaging, logs, metrics, security
+from app.core.compression import CompressionMiddleware
+from app.core.jobs import job_queue
+
+# Importing this module has no side effects: tables are created by an explicit
+# step (python init_db.py), and DB and HTTP resources are opened in `lifespan`.
+
+# --- Application lifespan: open shared resources once, close them on shutdown ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logs.setup()
+    config.check_settings()
+    await database.startup()
+    await http_client.startup()
+    await job_queue.start()
+    await credit_sweeper.start()
+    try:
+        yield
+    finally:
+        # Stop the workers first so in-flight jobs can still settle their credits.
+        await job_queue.stop()
+        await credit_sweeper.stop()
+        await http_client.shutdown()
+        await imaging.shutdown()
+        await database.shutdown()
+        security.shutdown()
+        logs.shutdown()
 
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan,
+)
+
+HTTP_REQUESTS_IN_FLIGHT = metrics.Gauge("http_requests_in_flight", "HTTP requests currently being handled.")
+HTTP_REQUEST_SECONDS = metrics.Histogram(
+    "http_request_seconds",
+    "HTTP request latency until the response starts, by method, handler and status.",
+    ["method", "handler", "status"],
 )
 
 # --- KEY ADDITION: A middleware to log every single request ---
@@ -38,19 +76,44 @@ app = FastAPI(
 @app.middleware("http")
 async def log_requests_middleware(request: Request, call_next):
     """
-    This middleware will log all incoming requests and their responses.
-    This helps to debug cases where requests don't seem to reach the endpoint logs.
+    Tags everything logged while handling a request with a request id (taken from a
+    well-formed X-Request-Id header, or generated) and logs one record per request.
     """
-    print(f"\n[BACKEND] Middleware: Received request: {request.method} {request.url}")
+    request_id = request.headers.get("X-Request-Id", "")
+    if not REQUEST_ID_RE.fullmatch(request_id):
+        request_id = uuid.uuid4().hex
+    token = logs.request_id_var.set(request_id)
+    start = time.perf_counter()
+    HTTP_REQUESTS_IN_FLIGHT.inc()
     try:
         response = await call_next(request)
-        print(f"[BACKEND] Middleware: Sending response with status: {response.status_code}")
-        return response
-    except Exception as e:
+    except Exception:
         # Log any exception that happens during the request processing
-        print(f"[BACKEND] Middleware: Exception caught: {type(e).__name__} - {e}")
         # We re-raise the exception to let FastAPI handle it and return a 500 error
+        logger.exception("Unhandled exception", extra={"method": request.method, "path": request.url.path})
+        logs.request_id_var.reset(token)
         raise
+    finally:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+    HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        # The matched endpoint's name (e.g. read_blob) keeps the series count bounded.
+        handler=getattr(request.scope.get("route"), "name", "unmatched"),
+        status=response.status_code,
+    )
+    response.headers["X-Request-Id"] = request_id
+    logger.info(
+        f"{request.method} {request.url.path} {response.status_code}",
+        extra={
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        },
+    )
+    logs.request_id_var.reset(token)
+    return response
 
 # Set all CORS enabled origins
 if settings.BACKEND_CORS_ORIGINS:
@@ -62,6 +125,14 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_headers=["*"],
     )
 
+if settings.RESPONSE_COMPRESSION:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.RESPONSE_COMPRESSION_MIN_SIZE,
+        gzip_level=settings.RESPONSE_GZIP_LEVEL,
+        brotli_quality=settings.RESPONSE_BROTLI_QUALITY,
+    )
+
 # --- Mount static files directory --- (No longer needed)
 # os.makedirs("app/static/generated", exist_ok=True)
 # app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -90,6 +161,21 @@ if settings.BACKEND_CORS_ORIGINS:
 # --- Include Routers ---
 app.include_router(api_v1_router, prefix=settings.API_V1_STR)
 
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def read_metrics(authorization: Optional[str] = Header(None)):
+        """
+        Prometheus scrape endpoint. Everything is rendered here, at scrape time.
+        Scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`; without a
+        configured token the endpoint does not exist, as it exposes traffic and credit flow.
+        """
+        if not settings.METRICS_TOKEN:
+            raise HTTPException(status_code=404, detail="Not Found")
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+            raise HTTPException(status_code=401, detail="Invalid metrics token.", headers={"WWW-Authenticate": "Bearer"})
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/")
 def read_root():
     return {"message": f"Welcome to the {settings.PROJECT_NAME} API!"}
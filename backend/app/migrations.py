@@ -0,0 +1,79 @@
+"""
+Schema changes that `Base.metadata.create_all` cannot make: changes to tables
+created by an earlier version of the models (such as new indexes) and
+dialect-specific structures such as the prompt search index. They run after
+create_all in `database.create_tables`. Every migration is idempotent, so
+running them again is harmless.
+"""
+import logging
+from typing import Callable, List
+
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+
+def _concurrently(conn: Connection) -> str:
+    # Postgres can build and drop indexes without locking out writes (outside a transaction).
+    return "CONCURRENTLY " if conn.dialect.name == "postgresql" else ""
+
+
+def images_owner_history_index(conn: Connection) -> None:
+    """Adds the (owner_id, id) index behind history paging and drops the unused index on prompt."""
+    concurrently = _concurrently(conn)
+    conn.exec_driver_sql(f"CREATE INDEX {concurrently}IF NOT EXISTS ix_images_owner_id_id ON images (owner_id, id)")
+    conn.exec_driver_sql(f"DROP INDEX {concurrently}IF EXISTS ix_images_prompt")
+
+
+# Text search configuration of the Postgres prompt index. Queries must use the
+# identical expression (see crud.image) for the index to apply.
+PROMPT_SEARCH_CONFIG = "english"
+PROMPT_TSVECTOR = f"to_tsvector('{PROMPT_SEARCH_CONFIG}', coalesce(prompt, ''))"
+
+
+def images_prompt_search(conn: Connection) -> None:
+    """
+    Full-text search over prompts: a GIN index on the prompt's tsvector on Postgres,
+    an FTS5 table kept in sync by triggers on SQLite. The FTS table also indexes
+    owner_id, so a search only visits the owner's matching rows.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.exec_driver_sql(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_images_prompt_search ON images USING GIN ({PROMPT_TSVECTOR})"
+        )
+    elif conn.dialect.name == "sqlite":
+        exists = conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'images_fts'").first()
+        if exists:
+            return
+        conn.exec_driver_sql(
+            "CREATE VIRTUAL TABLE images_fts USING fts5("
+            "prompt, owner_id, content='images', content_rowid='id', tokenize='porter unicode61')"
+        )
+        conn.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN "
+            "INSERT INTO images_fts(rowid, prompt, owner_id) VALUES (new.id, new.prompt, new.owner_id); END"
+        )
+        conn.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN "
+            "INSERT INTO images_fts(images_fts, rowid, prompt, owner_id) VALUES ('delete', old.id, old.prompt, old.owner_id); END"
+        )
+        conn.exec_driver_sql(
+            "CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE ON images BEGIN "
+            "INSERT INTO images_fts(images_fts, rowid, prompt, owner_id) VALUES ('delete', old.id, old.prompt, old.owner_id); "
+            "INSERT INTO images_fts(rowid, prompt, owner_id) VALUES (new.id, new.prompt, new.owner_id); END"
+        )
+        # Index the rows that existed before the table did.
+        conn.exec_driver_sql("INSERT INTO images_fts(images_fts) VALUES ('rebuild')")
+
+
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    images_owner_history_index,
+    images_prompt_search,
+]
+
+
+def run_migrations(engine: Engine) -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for migration in MIGRATIONS:
+            logger.info(f"Applying migration {migration.__name__}")
+            migration(conn)
@@ -1,3 +1,4 @@
 from .image import Image
 from .user import User
-from .credit_package import CreditPackage 
\ No newline at end of file
+from .credit_package import CreditPackage
+from .credit_transaction import CreditTransaction
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, UniqueConstraint, func
+from app.database import Base
+
+class CreditTransaction(Base):
+    """
+    Append-only credit ledger. Every balance change on `users.credits` writes a row here
+    in the same transaction.
+
+    kind:
+    * reserve - credits taken up front for a generation (`reference` identifies it)
+    * commit  - the reservation is settled; `amount` is what was finally kept
+    * refund  - credits returned when settling a reservation
+    * grant   - credits added outside of generations (purchases, admin top-ups)
+    """
+    __tablename__ = "credit_transactions"
+    # One commit per reservation makes settlement exactly-once at the DB level.
+    __table_args__ = (UniqueConstraint("reference", "kind", name="uq_credit_transactions_reference_kind"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String(255), ForeignKey("users.id"), index=True, nullable=False)
+    kind = Column(String(16), nullable=False)
+    amount = Column(Integer, nullable=False)
+    reference = Column(String(64), index=True, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
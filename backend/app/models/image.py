@@ -1,13 +1,17 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
 
 class Image(Base):
     __tablename__ = "images"
+    __table_args__ = (
+        # Serves history listing: WHERE owner_id = ? ORDER BY id DESC, paged by id.
+        Index("ix_images_owner_id_id", "owner_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    prompt = Column(String, index=True)
+    prompt = Column(String)
     image_url = Column(String)
     owner_id = Column(String(255), ForeignKey("users.id"))  # 修改为String类型匹配users.id
 
-    owner = relationship("User", back_populates="images") 
\ No newline at end of file
+    owner = relationship("User", back_populates="images")
@@ -1,17 +1,17 @@
 from sqlalchemy import Integer, String, Boolean, Column
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from fastapi_users_db_sqlalchemy import SQLAlchemyBaseUserTable
 from app.database import Base
 from typing import Optional
 
 
-class User(Base, SQLAlchemyBaseUserTable[str]):
+class User(Base):
     __tablename__ = "users"
 
     # Changed from Integer to String to support CUIDs from NextAuth
     id: Mapped[str] = mapped_column(String(255), primary_key=True, index=True)
     
-    # fastapi-users required fields
+    # fastapi-users user table fields, declared here rather than through its
+    # SQLAlchemyBaseUserTable mixin so the app does not import fastapi-users at startup.
     email: Mapped[str] = mapped_column(String(320), unique=True, index=True, nullable=False)
     hashed_password: Mapped[str] = mapped_column(String(1024), nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
@@ -1,24 +1,36 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional
-from fastapi_users import schemas
+from typing import List, Optional
 
-class UserRead(schemas.BaseUser[str]):
+# The user schemas declare the fastapi-users base fields themselves: importing
+# fastapi_users.schemas pulls in the whole fastapi-users package at startup.
+class UserRead(BaseModel):
     """User schema for reading user data, includes credits."""
     id: str
+    email: EmailStr
+    is_active: bool = True
+    is_superuser: bool = False
+    is_verified: bool = False
     credits: int
     creem_price_id: Optional[str] = None
     
     class Config:
         from_attributes = True
 
-class UserCreate(schemas.BaseUserCreate):
+class UserCreate(BaseModel):
     id: Optional[str] = None
     email: EmailStr
     credits: int = 100 # Default credits for new users
     password: str
+    is_active: Optional[bool] = True
+    is_superuser: Optional[bool] = False
+    is_verified: Optional[bool] = False
 
-class UserUpdate(schemas.BaseUserUpdate):
-    pass
+class UserUpdate(BaseModel):
+    password: Optional[str] = None
+    email: Optional[EmailStr] = None
+    is_active: Optional[bool] = None
+    is_superuser: Optional[bool] = None
+    is_verified: Optional[bool] = None
 
 # Shared properties
 class ImageBase(BaseModel):
@@ -32,15 +44,25 @@ class ImageCreate(ImageBase):
     color: Optional[str] = None
     composition: Optional[str] = None
     lighting: Optional[str] = None
+    # Image-to-image: a reference uploaded to /images/references/ (or any stored image),
+    # or, for older clients, the reference itself as Base64
+    reference_hash: Optional[str] = Field(None, pattern=r"^[0-9a-f]{64}$")
     image_b64: Optional[str] = Field(None, alias='image_b64')
-    reference_strength: Optional[float] = Field(None, alias='reference_strength')
+    reference_strength: Optional[float] = Field(None, alias='reference_strength', ge=0, le=1)
     turnstile_token: str = Field(..., alias='turnstile_token')
     model: Optional[str] = "tt-flux1-schnell"
+    # "url" returns links to /images/blob/{hash}; "b64_json" returns data URLs
+    response_format: Optional[str] = None
+    # Fixed seed for reproducible results; image i uses seed + i
+    seed: Optional[int] = Field(None, ge=1, le=4294967295)
+    # Opt in to (or out of) the prompt-level result cache; defaults to GENERATION_CACHE_DEFAULT
+    cache: Optional[bool] = None
+    num_images: int = Field(4, ge=1, le=8)
 
 # Properties stored in DB
 class ImageInDBBase(ImageBase):
     id: int
-    owner_id: Optional[int] = None
+    owner_id: Optional[str] = None
     image_url: Optional[str] = None
 
     class Config:
@@ -50,6 +72,39 @@ class ImageInDBBase(ImageBase):
 class Image(ImageInDBBase):
     pass
 
+class ImageHistoryItem(BaseModel):
+    id: int
+    prompt: Optional[str] = None
+    image_url: Optional[str] = None
+
+class ImageHistoryPage(BaseModel):
+    """One page of generation history, newest first."""
+    items: List[ImageHistoryItem]
+    # Pass as `cursor` to fetch the next (older) page; null on the last page.
+    next_cursor: Optional[int] = None
+
+class ImageSearchResult(ImageHistoryItem):
+    score: float
+
+class ImageSearchPage(BaseModel):
+    """One page of prompt search results, best match first."""
+    items: List[ImageSearchResult]
+    # Pass as `offset` to fetch the next page; null on the last page.
+    next_offset: Optional[int] = None
+
+class ReferenceImageRead(BaseModel):
+    """A stored image-to-image reference; pass `reference_hash` with a generation request."""
+    reference_hash: str
+
+class JobRead(BaseModel):
+    """Status of an asynchronous generation job."""
+    id: str
+    status: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
 class CreditPackageBase(BaseModel):
     name: str
     description: Optional[str] = None
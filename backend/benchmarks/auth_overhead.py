@@ -0,0 +1,61 @@
+"""
+Micro-benchmark: per-request cost of `deps.get_current_user` with cold caches
+(JWT verification plus a user lookup on every call, as before the caches existed)
+versus warm caches.
+
+Run from the backend directory:  python -m benchmarks.auth_overhead [iterations]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ.setdefault("NEXTAUTH_SECRET", "benchmark-secret")
+
+from jose import jwt  # noqa: E402
+
+from app.api import dependencies as deps  # noqa: E402
+from app.core import identity  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app import database  # noqa: E402
+from app.database import AsyncSessionLocal  # noqa: E402
+import app.crud as crud  # noqa: E402
+
+
+async def measure(token: str, iterations: int, cold: bool) -> list:
+    timings = []
+    for _ in range(iterations):
+        if cold:
+            deps.claims_cache.clear()
+            identity.identity_cache.clear()
+        start = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            await deps.get_current_user(db=db, authorization=f"Bearer {token}")
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(label: str, timings: list) -> None:
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95)]
+    print(f"{label:<12} mean {statistics.mean(timings) * 1e6:8.1f} us   p50 {statistics.median(timings) * 1e6:8.1f} us   p95 {p95 * 1e6:8.1f} us")
+
+
+async def main(iterations: int) -> None:
+    database.create_tables()
+    await database.startup()
+    async with AsyncSessionLocal() as db:
+        await crud.async_user.upsert_external(db, id="bench-user", email="bench@example.com")
+    token = jwt.encode({"sub": "bench-user", "exp": int(time.time()) + 3600}, settings.NEXTAUTH_SECRET, algorithm=deps.ALGORITHM)
+
+    await measure(token, 50, cold=True)  # Warm up the connection pool and imports
+    report("cold caches", await measure(token, iterations, cold=True))
+    report("warm caches", await measure(token, iterations, cold=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,98 @@
+"""
+Regression check: invalid generation requests must leave a user's credits untouched.
+Sends requests that pass the schema but fail after (or just before) credits would
+be reserved, such as an unsupported response_format or a bad image-to-image
+reference, then checks that the balance is unchanged and that no reservation is
+left unsettled on the ledger. Uses the same local stand-in upstreams as
+benchmarks/load_test.py, so nothing is sent to Fireworks or Cloudflare.
+
+Run from the backend directory:  python -m benchmarks.ledger_check
+Exits with status 1 if any request changed the balance or left a reservation open.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+from typing import Tuple
+
+import httpx
+
+from benchmarks.load_test import BACKEND_DIR, free_port, seed_users, start_process, stop_process, wait_until_ready
+
+USER = {"X-User-Id": "clloadtest0000000000000000", "X-User-Email": "load0@example.com"}
+
+# name -> fields merged into an otherwise valid 4-image request
+INVALID_REQUESTS = {
+    "unsupported response_format": {"response_format": "bogus"},
+    "invalid image_b64": {"image_b64": "!!not base64"},
+    "unknown reference_hash": {"reference_hash": "0" * 64},
+    "empty turnstile token": {"turnstile_token": ""},
+}
+
+OPEN_RESERVATIONS = (
+    "SELECT COUNT(*) FROM credit_transactions AS r WHERE r.kind = 'reserve' AND NOT EXISTS "
+    "(SELECT 1 FROM credit_transactions AS s WHERE s.reference = r.reference AND s.kind IN ('commit', 'refund'))"
+)
+
+
+def ledger_state(db_path: str) -> Tuple[int, int]:
+    """The test user's balance and the number of unsettled reservations."""
+    with sqlite3.connect(db_path) as conn:
+        (balance,) = conn.execute("SELECT credits FROM users WHERE id = ?", (USER["X-User-Id"],)).fetchone()
+        (open_reservations,) = conn.execute(OPEN_RESERVATIONS).fetchone()
+    return balance, open_reservations
+
+
+def main() -> int:
+    workdir = tempfile.mkdtemp(prefix="ledgercheck-")
+    db_path = os.path.join(workdir, "ledger.db")
+    seed_users(f"sqlite:///{db_path}", 1)
+
+    mock_port, api_port = free_port(), free_port()
+    mock_url, api_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{api_port}"
+    api_env = dict(
+        os.environ,
+        PYTHONPATH=BACKEND_DIR,
+        DATABASE_URL=f"sqlite:///{db_path}",
+        STORAGE_DIR=os.path.join(workdir, "blobs"),
+        FIREWORKS_API_KEY="ledger-check",
+        FIREWORKS_API_BASE_URL=f"{mock_url}/inference/v1/workflows/accounts/",
+        CLOUDFLARE_TURNSTILE_SECRET_KEY="ledger-check",
+        TURNSTILE_VERIFY_URL=f"{mock_url}/turnstile/v0/siteverify",
+        LOG_LEVEL="WARNING",
+    )
+    mock = start_process(
+        ["-m", "benchmarks.mock_upstream", "--port", str(mock_port), "--latency", "0.05"],
+        dict(os.environ, PYTHONPATH=BACKEND_DIR),
+        os.path.join(workdir, "mock.log"),
+    )
+    api = start_process(
+        ["-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(api_port), "--log-level", "warning", "--no-access-log"],
+        api_env,
+        os.path.join(workdir, "api.log"),
+    )
+    failures = 0
+    try:
+        wait_until_ready(f"{mock_url}/stats", mock)
+        wait_until_ready(f"{api_url}/api/v1/images/healthcheck/", api)
+        for i, (name, fields) in enumerate(INVALID_REQUESTS.items()):
+            before = ledger_state(db_path)
+            body = {"prompt": f"ledger check #{i}", "turnstile_token": f"ledger-check-{i}", "num_images": 4, **fields}
+            response = httpx.post(f"{api_url}/api/v1/images/generate/", json=body, headers=USER, timeout=30.0)
+            after = ledger_state(db_path)
+            ok = response.status_code >= 400 and after == before
+            failures += not ok
+            print(
+                f"{'ok  ' if ok else 'FAIL'} {name}: HTTP {response.status_code}, "
+                f"balance {before[0]} -> {after[0]}, open reservations {after[1]}"
+            )
+    finally:
+        for process in (api, mock):
+            stop_process(process)
+    if failures:
+        print(f"{failures} request(s) changed the ledger. Server logs: {workdir}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
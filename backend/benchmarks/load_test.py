@@ -0,0 +1,328 @@
+"""
+Load test: runs the API under uvicorn against local stand-in upstreams
+(benchmarks/mock_upstream.py) and drives `POST /images/generate/` with closed-loop
+clients at rising concurrency. Reports, per level: throughput, p50/p95/p99 latency,
+failures by status, the server's RSS and the DB queries and upstream calls made
+per request. Nothing is sent to Fireworks or Cloudflare.
+
+Save a run with --json and pass it as --baseline to a later run (e.g. before and
+after a change to images.py) to print the differences.
+
+Run from the backend directory:
+    python -m benchmarks.load_test [--concurrency 1,4,16,64] [--duration 20] [--latency 2.0] ...
+    python -m benchmarks.load_test --help   (all mock upstream options are accepted too)
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks import mock_upstream
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERS = 32
+METRIC_LINE_RE = re.compile(r"^(\w+)(?:\{([^}]*)\})? (\S+)$")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_users(database_url: str, count: int) -> None:
+    """Creates the schema and `count` users with credits that will not run out mid-test."""
+    env = dict(os.environ, DATABASE_URL=database_url, PYTHONPATH=BACKEND_DIR)
+    script = (
+        "from sqlalchemy import insert\n"
+        "from app import database\n"
+        "from app.models import User\n"
+        "database.create_tables()\n"
+        "with database.get_engine().begin() as conn:\n"
+        f"    conn.execute(insert(User), [{{'id': f'clloadtest{{i:016d}}', 'email': f'load{{i}}@example.com',"
+        f" 'hashed_password': '', 'credits': 10**9}} for i in range({count})])\n"
+    )
+    subprocess.run([sys.executable, "-c", script], env=env, cwd=BACKEND_DIR, check=True)
+
+
+def start_process(args: List[str], env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    # A process group of its own, so stopping it also stops its imaging pool workers.
+    with open(log_path, "ab") as log:
+        return subprocess.Popen(
+            [sys.executable, *args], env=env, cwd=BACKEND_DIR, start_new_session=True, stdout=log, stderr=subprocess.STDOUT
+        )
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=15)
+    except ProcessLookupError:
+        return
+    except subprocess.TimeoutExpired:
+        pass
+    # Forked pool workers inherit uvicorn's SIGTERM handler and ignore it, so
+    # whatever is left of the group is killed outright.
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with {process.returncode} before {url} was ready.")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} was not ready after {timeout:.0f}s.")
+
+
+def read_rss_mb(pid: int) -> Dict[str, Optional[float]]:
+    """Current and peak RSS of the server process, plus its children (the imaging pool). Linux only."""
+    def status(p: int) -> Dict[str, float]:
+        values = {}
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key in ("VmRSS", "VmHWM"):
+                        values[key] = int(value.split()[0]) / 1024
+        except OSError:
+            pass
+        return values
+
+    def children(p: int) -> List[int]:
+        try:
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                return [int(child) for child in f.read().split()]
+        except OSError:
+            return []
+
+    own = status(pid)
+    return {
+        "rss_mb": own.get("VmRSS"),
+        "peak_rss_mb": own.get("VmHWM"),
+        "children_rss_mb": sum(status(child).get("VmRSS", 0.0) for child in children(pid)),
+    }
+
+
+def scrape_totals(api_url: str, token: str) -> Dict[str, float]:
+    """Sums the counters the report needs from the Prometheus endpoint."""
+    totals = {"db_queries": 0.0, "upstream_calls": 0.0}
+    response = httpx.get(f"{api_url}/metrics", headers={"Authorization": f"Bearer {token}"}, timeout=10.0)
+    response.raise_for_status()
+    for line in response.text.splitlines():
+        match = METRIC_LINE_RE.match(line)
+        if not match:
+            continue
+        name, value = match.group(1), float(match.group(3))
+        if name == "db_query_seconds_count":
+            totals["db_queries"] += value
+        elif name == "upstream_requests_total":
+            totals["upstream_calls"] += value
+    return totals
+
+
+def percentile(ordered: List[float], p: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+async def run_level(api_url: str, concurrency: int, duration: float, num_images: int, run_id: str) -> dict:
+    """Closed loop: `concurrency` clients each send their next request as soon as the last one returns."""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = 0
+    deadline = time.monotonic() + duration
+
+    async def client_loop(client: httpx.AsyncClient) -> None:
+        nonlocal counter
+        while time.monotonic() < deadline:
+            counter += 1
+            i = counter
+            user = i % USERS
+            body = {
+                # Distinct prompts, so requests are never coalesced or served from cache.
+                "prompt": f"load test {run_id} c{concurrency} #{i}: a castle on a hill at sunset",
+                "turnstile_token": f"load-{run_id}-{concurrency}-{i}",
+                "aspect_ratio": "1:1",
+                "num_images": num_images,
+            }
+            headers = {"X-User-Id": f"clloadtest{user:016d}", "X-User-Email": f"load{user}@example.com"}
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{api_url}/api/v1/images/generate/", json=body, headers=headers)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == "200":
+                latencies.append(elapsed)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=300.0, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": sum(statuses.values()),
+        "ok": len(latencies),
+        "statuses": statuses,
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "images_per_second": len(latencies) * num_images / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def format_ms(seconds: Optional[float]) -> str:
+    return f"{seconds * 1000:8.0f}" if seconds is not None else f"{'-':>8}"
+
+
+def print_header() -> None:
+    print(
+        f"{'conc':>5} {'reqs':>6} {'ok':>6} {'req/s':>7} {'img/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'RSS MB':>7} {'peak MB':>8} {'pool MB':>8} {'db q/req':>9} {'up/req':>7}  failures"
+    )
+
+
+def print_level(level: dict) -> None:
+    failures = {status: n for status, n in level["statuses"].items() if status != "200"}
+    requests = max(level["requests"], 1)
+    print(
+        f"{level['concurrency']:>5} {level['requests']:>6} {level['ok']:>6} {level['throughput']:>7.2f} "
+        f"{level['images_per_second']:>7.2f} {format_ms(level['p50'])} {format_ms(level['p95'])} {format_ms(level['p99'])} "
+        f"{level['rss_mb'] or 0:>7.0f} {level['peak_rss_mb'] or 0:>8.0f} {level['children_rss_mb']:>8.0f} "
+        f"{level['db_queries'] / requests:>9.1f} {level['upstream_calls'] / requests:>7.2f}  {failures or ''}",
+        flush=True,
+    )
+
+
+def print_comparison(levels: List[dict], baseline: dict) -> None:
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    print("\nCompared with the baseline (positive throughput / negative latency is better):")
+    print(f"{'conc':>5} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'db q/req':>9}")
+
+    def change(new: Optional[float], old: Optional[float]) -> str:
+        if not new or not old:
+            return f"{'-':>9}"
+        return f"{(new - old) / old * 100:>+8.1f}%"
+
+    for level in levels:
+        old = previous.get(level["concurrency"])
+        if old is None:
+            continue
+        per_request = lambda l: l["db_queries"] / max(l["requests"], 1)
+        print(
+            f"{level['concurrency']:>5} {change(level['throughput'], old['throughput'])} "
+            f"{change(level['p50'], old['p50'])} {change(level['p95'], old['p95'])} {change(level['p99'], old['p99'])} "
+            f"{change(per_request(level), per_request(old))}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated client counts, run in order")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per concurrency level")
+    parser.add_argument("--num-images", type=int, default=4)
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--baseline", help="A report written by --json to compare against")
+    parser.add_argument("--api-env", action="append", default=[], metavar="NAME=VALUE", help="Extra settings for the API process")
+    mock_upstream.add_arguments(parser)
+    args = parser.parse_args()
+    levels_to_run = [int(value) for value in args.concurrency.split(",")]
+    config = mock_upstream.config_from_args(args)
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    database_url = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    seed_users(database_url, USERS)
+
+    mock_port, api_port = free_port(), free_port()
+    mock_url, api_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{api_port}"
+    mock_args = ["-m", "benchmarks.mock_upstream", "--port", str(mock_port)]
+    for name, value in vars(args).items():
+        if hasattr(config, name):
+            mock_args += ["--" + name.replace("_", "-"), str(value)]
+    metrics_token = secrets.token_urlsafe(16)
+    api_env = dict(
+        os.environ,
+        PYTHONPATH=BACKEND_DIR,
+        DATABASE_URL=database_url,
+        STORAGE_DIR=os.path.join(workdir, "blobs"),
+        FIREWORKS_API_KEY="load-test",
+        FIREWORKS_API_BASE_URL=f"{mock_url}/inference/v1/workflows/accounts/",
+        CLOUDFLARE_TURNSTILE_SECRET_KEY="load-test",
+        TURNSTILE_VERIFY_URL=f"{mock_url}/turnstile/v0/siteverify",
+        LOG_LEVEL="WARNING",
+        METRICS_ENABLED="true",
+        METRICS_TOKEN=metrics_token,
+    )
+    for item in args.api_env:
+        name, _, value = item.partition("=")
+        api_env[name] = value
+
+    mock = start_process(mock_args, dict(os.environ, PYTHONPATH=BACKEND_DIR), os.path.join(workdir, "mock.log"))
+    api = start_process(
+        ["-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(api_port), "--log-level", "warning", "--no-access-log"],
+        api_env,
+        os.path.join(workdir, "api.log"),
+    )
+    try:
+        wait_until_ready(f"{mock_url}/stats", mock)
+        wait_until_ready(f"{api_url}/api/v1/images/healthcheck/", api)
+        print(f"Mock upstream: {json.dumps(httpx.get(f'{mock_url}/stats').json()['config'])}")
+        print(f"Server logs: {workdir}")
+        print(f"Levels {levels_to_run}, {args.duration:g}s each, {args.num_images} images per request\n")
+
+        run_id = f"{int(time.time())}"
+        levels = []
+        print_header()
+        for concurrency in levels_to_run:
+            before = scrape_totals(api_url, metrics_token)
+            level = asyncio.run(run_level(api_url, concurrency, args.duration, args.num_images, run_id))
+            after = scrape_totals(api_url, metrics_token)
+            level.update({key: after[key] - before[key] for key in after})
+            level.update(read_rss_mb(api.pid))
+            levels.append(level)
+            print_level(level)
+
+        report = {"mock": httpx.get(f"{mock_url}/stats").json(), "levels": levels}
+        if args.baseline:
+            with open(args.baseline) as f:
+                print_comparison(levels, json.load(f))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"\nReport written to {args.json}")
+    finally:
+        for process in (api, mock):
+            stop_process(process)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Local stand-in for the upstreams a generation request calls: Fireworks.ai
+`text_to_image` / `image_to_image` workflows and Cloudflare Turnstile `siteverify`.
+Latency, error rate, 429s and image size are configurable, so the service can be
+load-tested without paying for (or being throttled by) the real APIs.
+
+Point the API at it with
+    FIREWORKS_API_BASE_URL=http://127.0.0.1:9100/inference/v1/workflows/accounts/
+    TURNSTILE_VERIFY_URL=http://127.0.0.1:9100/turnstile/v0/siteverify
+
+Run from the backend directory:  python -m benchmarks.mock_upstream [--port 9100] [--help]
+(benchmarks/load_test.py starts it by itself.)
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import math
+import os
+import random
+import struct
+import zlib
+from dataclasses import asdict, dataclass
+from typing import Dict
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+@dataclass
+class MockConfig:
+    latency: float = 2.0 # Median seconds per Fireworks call
+    latency_sigma: float = 0.3 # Log-normal spread around the median; 0 makes every call take `latency`
+    slow_rate: float = 0.0 # Fraction of calls that straggle (what hedging is for)
+    slow_latency: float = 10.0
+    error_rate: float = 0.0 # Fraction of calls answered with a 503
+    throttle_rate: float = 0.0 # Fraction of calls answered with a 429
+    retry_after: float = 1.0 # Retry-After sent with 429s
+    image_kb: int = 1500 # Approximate PNG size per image
+    unique_images: bool = True # Make every image distinct, so nothing is deduplicated by content hash
+    turnstile_latency: float = 0.05
+    turnstile_failure_rate: float = 0.0
+    seed: int = 0
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+def make_png(approx_bytes: int, rng: random.Random) -> bytes:
+    """A valid RGB noise PNG of roughly `approx_bytes`; noise barely compresses, like real outputs."""
+    from PIL import Image
+
+    side = max(8, int(math.sqrt(approx_bytes / 3)))
+    image = Image.frombytes("RGB", (side, side), rng.randbytes(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+class MockUpstream:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.image = make_png(config.image_kb * 1024, self.rng)
+        self.counts: Dict[str, int] = {}
+
+    def count(self, key: str) -> None:
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def sample_latency(self) -> float:
+        config = self.config
+        if config.slow_rate and self.rng.random() < config.slow_rate:
+            return config.slow_latency
+        if config.latency_sigma <= 0:
+            return config.latency
+        return config.latency * math.exp(self.rng.gauss(0.0, config.latency_sigma))
+
+    def next_image(self) -> bytes:
+        if not self.config.unique_images:
+            return self.image
+        # An ancillary chunk before IEND changes the content hash but not the pixels.
+        nonce = png_chunk(b"tEXt", b"nonce\0" + os.urandom(8).hex().encode("ascii"))
+        return self.image[:-12] + nonce + self.image[-12:]
+
+    async def generate(self, request: Request) -> Response:
+        config = self.config
+        await request.body()
+        await asyncio.sleep(self.sample_latency())
+        roll = self.rng.random()
+        if roll < config.throttle_rate:
+            self.count("fireworks_429")
+            return JSONResponse({"error": "rate limited"}, status_code=429, headers={"Retry-After": f"{config.retry_after:g}"})
+        if roll < config.throttle_rate + config.error_rate:
+            self.count("fireworks_503")
+            return JSONResponse({"error": "unavailable"}, status_code=503)
+        self.count("fireworks_ok")
+        if "application/json" in request.headers.get("accept", ""):
+            try:
+                samples = int(json.loads(await request.body()).get("samples", 1))
+            except (ValueError, AttributeError):
+                samples = 1
+            return JSONResponse([{"base64": base64.b64encode(self.next_image()).decode("ascii")} for _ in range(samples)])
+        return Response(self.next_image(), media_type="image/png")
+
+    async def siteverify(self, request: Request) -> Response:
+        await request.form()
+        await asyncio.sleep(self.config.turnstile_latency)
+        if self.rng.random() < self.config.turnstile_failure_rate:
+            self.count("turnstile_failed")
+            return JSONResponse({"success": False, "error-codes": ["invalid-input-response"]})
+        self.count("turnstile_ok")
+        return JSONResponse({"success": True})
+
+    async def stats(self, request: Request) -> Response:
+        return JSONResponse({"counts": self.counts, "config": asdict(self.config)})
+
+
+def create_app(config: MockConfig) -> Starlette:
+    upstream = MockUpstream(config)
+    return Starlette(routes=[
+        Route("/inference/v1/workflows/accounts/{model:path}/text_to_image", upstream.generate, methods=["POST"]),
+        Route("/inference/v1/workflows/accounts/{model:path}/image_to_image", upstream.generate, methods=["POST"]),
+        Route("/turnstile/v0/siteverify", upstream.siteverify, methods=["POST"]),
+        Route("/stats", upstream.stats),
+    ])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds one --option per MockConfig field (shared with benchmarks/load_test.py)."""
+    for name, default in asdict(MockConfig()).items():
+        flag = "--" + name.replace("_", "-")
+        if isinstance(default, bool):
+            parser.add_argument(flag, type=lambda v: v.lower() in ("1", "true", "yes"), default=default, metavar="BOOL")
+        else:
+            parser.add_argument(flag, type=type(default), default=default)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(**{name: getattr(args, name) for name in asdict(MockConfig())})
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
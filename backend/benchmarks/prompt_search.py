@@ -0,0 +1,83 @@
+"""
+Benchmark: prompt search latency as one user's history grows, with other users'
+images in the same table. Ranking is capped at PROMPT_SEARCH_MAX_CANDIDATES
+matches, so latency should grow far slower than the history; on SQLite what
+remains is FTS5 scanning doclists for bm25's document frequencies.
+
+Run from the backend directory:  python -m benchmarks.prompt_search [queries]
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+
+from sqlalchemy import insert  # noqa: E402
+
+from app import database  # noqa: E402
+from app.database import AsyncSessionLocal  # noqa: E402
+from app.models import Image  # noqa: E402
+import app.crud as crud  # noqa: E402
+
+WORDS = (
+    "red blue golden ancient castle dragon forest river mountain sunset portrait cat dog "
+    "city night neon watercolor oil painting cyberpunk samurai robot ocean desert winter "
+    "spring garden temple bridge lantern fox owl whale galaxy nebula village market"
+).split()
+HISTORY_SIZES = [1_000, 10_000, 50_000]
+OTHER_USERS_IMAGES = 50_000
+QUERIES = ["castle", "golden dragon", "neon city night", "wat", "samurai robot ocean"]
+# NextAuth user ids are CUIDs: a single search token, as real owners would be.
+USER_ID = "clbenchuser000000000000001"
+OTHER_USER_ID = "clbenchother00000000000001"
+
+
+def prompts(count: int, rng: random.Random) -> list:
+    return [" ".join(rng.sample(WORDS, 6)) for _ in range(count)]
+
+
+async def add_images(owner_id: str, count: int, rng: random.Random) -> None:
+    async with AsyncSessionLocal() as db:
+        for start in range(0, count, 5_000):
+            rows = [
+                {"prompt": prompt, "image_url": f"/images/blob/{owner_id}-{start + i}", "owner_id": owner_id}
+                for i, prompt in enumerate(prompts(min(5_000, count - start), rng))
+            ]
+            await db.execute(insert(Image), rows)
+        await db.commit()
+
+
+async def measure(owner_id: str, iterations: int) -> list:
+    timings = []
+    async with AsyncSessionLocal() as db:
+        for i in range(iterations):
+            query = QUERIES[i % len(QUERIES)]
+            start = time.perf_counter()
+            await crud.async_image.search(db, owner_id=owner_id, query=query, limit=21)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def main(iterations: int) -> None:
+    database.create_tables()
+    await database.startup()
+    rng = random.Random(0)
+    await add_images(OTHER_USER_ID, OTHER_USERS_IMAGES, rng)
+    size = 0
+    for target in HISTORY_SIZES:
+        await add_images(USER_ID, target - size, rng)
+        size = target
+        await measure(USER_ID, 20)  # Warm up
+        timings = sorted(await measure(USER_ID, iterations))
+        p95 = timings[int(len(timings) * 0.95)]
+        print(f"{size:>7} images   p50 {statistics.median(timings) * 1000:7.2f} ms   p95 {p95 * 1000:7.2f} ms")
+    await database.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
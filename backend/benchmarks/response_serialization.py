@@ -0,0 +1,100 @@
+"""
+Benchmark: serializing a `response_format="b64_json"` generation response (four
+data URLs, several MB in total), before and after the orjson / pre-encoded
+response layer, and with gzip or Brotli on top. Every variant runs in a fresh
+process, so the peak RSS it reports is that of building one response.
+
+Run from the backend directory:  python -m benchmarks.response_serialization [iterations] [image_kb]
+"""
+import json
+import os
+import subprocess
+import sys
+
+IMAGES = 4
+
+CHILD = """
+import base64, json, random, resource, sys, time
+variant, iterations, image_bytes = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+
+from starlette.responses import JSONResponse
+from app.core.compression import CompressionMiddleware
+from app.core.responses import ORJSONResponse, RawJSON
+
+rng = random.Random(0)
+# Generated PNGs are already compressed, so random bytes are a fair stand-in.
+images = [rng.randbytes(image_bytes) for _ in range({images})]
+compressor = CompressionMiddleware(None)
+
+def build():
+    if variant == "before":
+        urls = [f"data:image/png;base64,{{base64.b64encode(b).decode('utf-8')}}" for b in images]
+        return JSONResponse(content={{"images": urls}}).body
+    urls = [RawJSON.data_url("image/png", base64.b64encode(b)) for b in images]
+    body = ORJSONResponse(content={{"images": urls}}).body
+    if variant in ("gzip", "br"):
+        body = compressor.compress(body, variant)
+    return body
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+baseline = max_rss_kb()
+body = build()
+peak = max_rss_kb() - baseline
+if variant in ("before", "after"):
+    assert len(json.loads(body)["images"]) == {images}
+size = len(body)
+del body
+
+start = time.perf_counter()
+for _ in range(iterations):
+    build()
+elapsed = (time.perf_counter() - start) / iterations
+print(json.dumps({{"seconds": elapsed, "bytes": size, "peak_rss_kb": peak}}))
+""".format(images=IMAGES)
+
+
+def variants():
+    names = ["before", "after", "gzip"]
+    try:
+        import brotli  # noqa: F401
+        names.append("br")
+    except ImportError:
+        pass
+    return names
+
+
+def run(variant: str, iterations: int, image_bytes: int) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, variant, str(iterations), str(image_bytes)],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(iterations: int, image_kb: int) -> None:
+    raw_total = IMAGES * image_kb * 1024
+    print(f"{IMAGES} images x {image_kb} KB, {iterations} iterations per variant")
+    print(f"{'variant':<8} {'ms/response':>12} {'body MB':>9} {'raw MB/s':>10} {'body MB/s':>10} {'peak RSS MB':>12}")
+    for variant in variants():
+        result = run(variant, iterations, image_kb * 1024)
+        seconds = result["seconds"]
+        print(
+            f"{variant:<8} {seconds * 1000:12.1f} {result['bytes'] / 1e6:9.2f} "
+            f"{raw_total / seconds / 1e6:10.1f} {result['bytes'] / seconds / 1e6:10.1f} "
+            f"{result['peak_rss_kb'] / 1024:12.1f}"
+        )
+    print("raw MB/s: image bytes delivered per second; body MB/s: response bytes produced per second")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1536,
+    )
@@ -0,0 +1,66 @@
+"""
+Startup benchmark: time from interpreter start to a ready `app.main`, measured in
+fresh processes (as a new worker would start), split into importing the module
+and running the lifespan startup until the app could serve its first request.
+
+Run from the backend directory:  python -m benchmarks.startup [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CHILD = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+
+async def ready():
+    async with app.main.app.router.lifespan_context(app.main.app):
+        return time.perf_counter()
+
+ready_at = asyncio.run(ready())
+print(json.dumps({
+    "import": imported - start,
+    "lifespan": ready_at - imported,
+    "total": ready_at - start,
+    "modules": len(sys.modules),
+    "pillow": "PIL.Image" in sys.modules,
+    "fastapi_users": "fastapi_users" in sys.modules,
+}))
+"""
+
+
+def run_once(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    # Log records from the lifespan may precede the result on stdout.
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(runs: int) -> None:
+    env = dict(os.environ)
+    # Point at a database that does not exist yet: startup must not need it.
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    run_once(env)  # Warm the filesystem and bytecode caches
+    results = [run_once(env) for _ in range(runs)]
+    for key in ("import", "lifespan", "total"):
+        values = [r[key] * 1000 for r in results]
+        print(f"{key:<10} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms   max {max(values):8.1f} ms")
+    last = results[-1]
+    print(f"modules loaded: {last['modules']}   Pillow imported: {last['pillow']}   fastapi-users imported: {last['fastapi_users']}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
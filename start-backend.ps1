@@ -57,6 +57,15 @@ if ($apiKeyCheck -eq "MISSING") {
     }
 }
 
+# 初始化/升级数据库 (创建缺失的表、索引和搜索表; 可重复运行)
+# 服务器启动时不再自动建表, 因此每次启动前都需要执行这一步
+Write-Host "初始化数据库..." -ForegroundColor Yellow
+python init_db.py
+if ($LASTEXITCODE -ne 0) {
+    Write-Host "错误: 数据库初始化失败。请检查 .env 中的 DATABASE_URL。" -ForegroundColor Red
+    exit 1
+}
+
 # 启动服务器
 Write-Host ""
 Write-Host "🚀 启动FastAPI服务器..." -ForegroundColor Green